@@ -0,0 +1,254 @@
+"""
+benchmark.py
+
+
+OVERVIEW
+
+This script measures how the fitting pipeline scales with the size of the
+record.  For every requested size it writes a synthetic station file (see
+`synthetic.py`) and then times the pipeline stages
+
+   load    read and parse the file (`wind_data.read_station`)
+   fit     compute mean, meanCube and the below-mean fraction
+   solve   solve the moment equation of `main.py` for k and derive c
+
+reporting wall time and rows per second of every stage, and its peak memory.
+By default the memory column is the peak resident set size of the process
+(`ru_maxrss`) after the stage, which never decreases from one stage to the
+next.  With `--memory`, every stage is run a second time under `tracemalloc`
+and the column is the peak memory traced during that stage alone; tracing
+slows the load stage down by an order of magnitude, so the timings always come
+from the untraced run.
+
+With `--stream`, load and fit are replaced by a single pass that bins every
+parsed block into a `SpeedHistogram` and never holds the whole record in
+memory; use it for sizes beyond what fits in RAM (10^8 to 10^9 rows).
+
+With `--compress`, every station file is also written compressed in the given
+formats, and the end-to-end throughput (load, fit and solve) of raw and
+compressed input is compared over `--files` copies of the file: once reading
+the copies one after the other, and once with `wind_data.read_stations`, which
+decompresses and parses the next files in `--workers` threads while the
+current one is fitted.  Throughput is reported in rows per second and in MB
+per second of input as stored on disk.
+
+
+USAGE
+
+   python benchmark.py                          # 10^5, 10^6 and 10^7 rows
+   python benchmark.py --sizes 1e5 1e9 --stream --resolution 1-second
+   python benchmark.py --sizes 1e6 --compress gzip bz2 xz --files 8
+"""
+
+import argparse
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import synthetic
+import weibull
+from binned import SpeedHistogram
+from wind_data import (COMPRESSIONS, iter_blocks, open_station,
+  read_station, read_stations)
+
+_EXTENSIONS= {'gzip': '.gz', 'bz2': '.bz2', 'xz': '.xz'}
+
+
+def _max_rss():
+   # Peak resident set size in bytes (`ru_maxrss` is in KiB on Linux and in
+   # bytes on macOS).
+   rss= resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+   return rss if sys.platform == 'darwin' else 1024 * rss
+
+
+def _stage(results, name, rows, traced, function, *args):
+   # Runs one stage, records (name, seconds, rows per second, peak bytes) and
+   # returns the stage's result.
+   start= time.perf_counter()
+   value= function(*args)
+   seconds= time.perf_counter() - start
+
+   if traced:
+      del value
+      tracemalloc.start()
+      try:
+         value= function(*args)
+         peak= tracemalloc.get_traced_memory()[1]
+      finally:
+         tracemalloc.stop()
+   else:
+      peak= _max_rss()
+
+   results.append((name, seconds, rows / seconds if seconds else float('inf'),
+     peak))
+   return value
+
+
+def _streamed_histogram(path):
+   hist= SpeedHistogram()
+   with open_station(path) as inputfile:
+      for block in iter_blocks(inputfile):
+         hist= hist + SpeedHistogram.from_speeds(block[1])
+   return hist
+
+
+def run(path, rows, stream=False, traced=False):
+   """
+   OVERVIEW
+
+   This function runs the pipeline on the station file `path`, which holds
+   `rows` rows, and returns a list of `(stage, seconds, rows per second, peak
+   bytes)` tuples.  `traced` selects the memory measurement (see above).
+   """
+
+   results= []
+   if stream:
+      hist= _stage(results, 'load+fit', rows, traced, _streamed_histogram,
+        path)
+      statistics= hist.moment_statistics()
+   else:
+      series= _stage(results, 'load', rows, traced, read_station, path)
+      statistics= _stage(results, 'fit', rows, traced,
+        weibull.moment_statistics, series.speed)
+      del series
+   _stage(results, 'solve', rows, traced, weibull.fit_moments, *statistics)
+   return results
+
+
+def _fit_series(series):
+   return weibull.fit_moments(*weibull.moment_statistics(series.speed))
+
+
+def compress(path, format):
+   """
+   OVERVIEW
+
+   This function writes a copy of the file `path` compressed in `format` (a
+   key of `wind_data.COMPRESSIONS`) next to it and returns its path.
+   """
+
+   target= path + _EXTENSIONS[format]
+   with open(path, 'rb') as inputfile:
+      with COMPRESSIONS[format][1](target, 'wb') as outputfile:
+         shutil.copyfileobj(inputfile, outputfile, 1 << 22)
+   return target
+
+
+def run_end_to_end(path, rows, files=4, workers=4):
+   """
+   OVERVIEW
+
+   This function loads, fits and solves `files` copies of the station file
+   `path` (of `rows` rows each), first one after the other and then with
+   `wind_data.read_stations` in `workers` threads, and returns a list of
+   `(mode, seconds, rows per second, input bytes per second)` tuples.
+   """
+
+   paths= [path] * files
+   total_rows= rows * files
+   total_bytes= os.path.getsize(path) * files
+   results= []
+
+   start= time.perf_counter()
+   for name in paths:
+      _fit_series(read_station(name))
+   seconds= time.perf_counter() - start
+   results.append(('serial', seconds, total_rows / seconds,
+     total_bytes / seconds))
+
+   start= time.perf_counter()
+   for _, series in read_stations(paths, workers):
+      _fit_series(series)
+   seconds= time.perf_counter() - start
+   results.append(('threads', seconds, total_rows / seconds,
+     total_bytes / seconds))
+   return results
+
+
+def main(argv=None):
+   parser= argparse.ArgumentParser(description="Benchmark load, fit and solve "
+     "on synthetic station files.")
+   parser.add_argument('--sizes', type=float, nargs='+',
+     default=[1e5, 1e6, 1e7], help="numbers of rows to generate")
+   parser.add_argument('--resolution', default='hourly',
+     choices=sorted(synthetic.RESOLUTIONS), help="time step of the records")
+   parser.add_argument('--stream', action='store_true',
+     help="bin the file block by block instead of loading it whole")
+   parser.add_argument('--memory', action='store_true',
+     help="measure per-stage peak memory with tracemalloc (slow)")
+   parser.add_argument('--directory', default=None,
+     help="where to write the station files (default: a temporary directory)")
+   parser.add_argument('--keep', action='store_true',
+     help="keep the generated station files")
+   parser.add_argument('--seed', type=int, default=0)
+   parser.add_argument('--compress', nargs='+', default=[],
+     choices=sorted(COMPRESSIONS), help="also compare end-to-end throughput "
+     "of these compressed formats with raw input")
+   parser.add_argument('--files', type=int, default=4,
+     help="copies of the file per end-to-end run (default: %(default)s)")
+   parser.add_argument('--workers', type=int, default=4,
+     help="threads of the overlapped end-to-end run (default: %(default)s)")
+   args= parser.parse_args(argv)
+
+   directory= args.directory or tempfile.mkdtemp(prefix='wind-benchmark-')
+
+   print('%12s  %-9s %10s %14s %12s'
+     % ('rows', 'stage', 'seconds', 'rows/s', 'peak MiB'))
+
+   for size in args.sizes:
+      size= int(size)
+      path= os.path.join(directory, 'synthetic_%d.txt' % size)
+
+      # Four-digit years limit the length of a record; use the coarsest
+      # resolution that still fits:
+      resolution= args.resolution
+      if size > synthetic.max_steps(resolution):
+         finer= [name for name, step in sorted(synthetic.RESOLUTIONS.items(),
+           key=lambda item: -item[1]) if size <= synthetic.max_steps(name)
+           and step < synthetic.RESOLUTIONS[args.resolution]]
+         if not finer:
+            parser.error("%d rows do not fit before the year 9999 at any "
+              "resolution." % size)
+         resolution= finer[0]
+         print('%12d  does not fit at %s resolution; using %s.'
+           % (size, args.resolution, resolution))
+
+      start= time.perf_counter()
+      rows= synthetic.write_station(path, size, resolution=resolution,
+        seed=args.seed)
+      seconds= time.perf_counter() - start
+      print('%12d  %-9s %10.3f %14.0f %12s'
+        % (rows, 'generate', seconds, rows / seconds, '-'))
+
+      for stage, seconds, rate, peak in run(path, rows, args.stream,
+        args.memory):
+         print('%12d  %-9s %10.3f %14.0f %12.1f'
+           % (rows, stage, seconds, rate, peak / 2.0**20))
+
+      if args.compress:
+         print('\n%12s  %-9s %-9s %10s %14s %12s'
+           % ('rows', 'input', 'mode', 'seconds', 'rows/s', 'input MB/s'))
+         for format in ['raw'] + args.compress:
+            name= path if format == 'raw' else compress(path, format)
+            for mode, seconds, rate, byte_rate in run_end_to_end(name, rows,
+              args.files, args.workers):
+               print('%12d  %-9s %-9s %10.3f %14.0f %12.1f'
+                 % (rows * args.files, format, mode, seconds, rate,
+                 byte_rate / 1.e6))
+            if format != 'raw' and not args.keep:
+               os.remove(name)
+         print()
+
+      if not args.keep:
+         os.remove(path)
+
+   if not args.keep and not args.directory:
+      os.rmdir(directory)
+
+
+if __name__ == '__main__':
+   main()
@@ -0,0 +1,211 @@
+"""
+binned.py
+
+
+OVERVIEW
+
+Wind speed is recorded with a fixed resolution (0.1 m/s in `input.txt`), so
+even decades of hourly data contain only a few hundred distinct values.  This
+module provides `SpeedHistogram`, which stores the number of samples in every
+speed bin.  Histograms from different files or years are merged by adding them,
+and the statistics used by the Weibull fits (see `weibull.py`) and empirical
+quantiles are computed directly from the bin counts.
+
+Bin `i` holds the speed `i / bins_per_unit`, which is exactly the value that
+parsing the corresponding decimal string produces (e.g. 13 / 10 == 1.3).
+Comparisons against the bin speeds are therefore exact, and `fraction_below`
+reproduces the `cumulative` count of `main.py` exactly.  Sums are accumulated
+in integer arithmetic, so moments agree with the raw-sample computation to
+within floating-point rounding of the final division.
+"""
+
+import numpy as np
+
+import weibull
+from find_roots import find_root_bisection
+
+
+class SpeedHistogram(object):
+   """
+   OVERVIEW
+
+   Counts of wind-speed samples per bin of width `resolution`.
+
+   INPUTS
+
+   `counts` is a sequence of non-negative integers; `counts[i]` is the number
+   of samples with speed `i * resolution`.
+
+   `resolution` is the bin width; `1 / resolution` must be an integer.
+   """
+
+   def __init__(self, counts=(), resolution=0.1):
+      bins_per_unit= round(1.0 / resolution)
+      if bins_per_unit < 1 or abs(bins_per_unit * resolution - 1.0) > 1.e-9:
+         raise ValueError("`1 / resolution` must be a positive integer.")
+
+      counts= np.asarray(counts, dtype=np.int64)
+      if counts.ndim != 1 or np.any(counts < 0):
+         raise ValueError("`counts` must be a 1-D array of non-negative "
+           "integers.")
+
+      self.counts= counts
+      self.bins_per_unit= bins_per_unit
+
+   @property
+   def resolution(self):
+      return 1.0 / self.bins_per_unit
+
+   @classmethod
+   def from_speeds(cls, speeds, resolution=0.1):
+      """
+      OVERVIEW
+
+      This method bins raw speeds.  A `ValueError` is raised if any speed is
+      negative or does not lie on the `resolution` grid.
+      """
+
+      hist= cls(resolution=resolution)
+      speeds= np.asarray(speeds, dtype=np.float64)
+      index= np.rint(speeds * hist.bins_per_unit)
+
+      if np.any(index < 0):
+         raise ValueError("Wind speeds must be non-negative.")
+      if np.any(index / hist.bins_per_unit != speeds):
+         raise ValueError("Wind speeds do not lie on a grid of resolution "
+           "%g." % hist.resolution)
+
+      hist.counts= np.bincount(index.astype(np.int64))
+      return hist
+
+   @classmethod
+   def from_file(cls, path, resolution=0.1):
+      """This method bins the speeds of the station file `path`."""
+      from wind_data import read_station
+      return cls.from_speeds(read_station(path).speed, resolution)
+
+   @classmethod
+   def load(cls, path):
+      """This method reads a histogram written by `save`."""
+      with np.load(path) as archive:
+         return cls(archive['counts'], 1.0 / int(archive['bins_per_unit']))
+
+   def save(self, path):
+      """This method writes the histogram to the `.npz` file `path`."""
+      np.savez(path, counts=self.counts, bins_per_unit=self.bins_per_unit)
+
+   def __add__(self, other):
+      if isinstance(other, int) and other == 0:
+         return self
+      if not isinstance(other, SpeedHistogram):
+         return NotImplemented
+      if other.bins_per_unit != self.bins_per_unit:
+         raise ValueError("Cannot merge histograms of different resolution.")
+
+      counts= np.zeros(max(len(self.counts), len(other.counts)), np.int64)
+      counts[:len(self.counts)]+= self.counts
+      counts[:len(other.counts)]+= other.counts
+      return SpeedHistogram(counts, self.resolution)
+
+   # Allows `sum(histograms)`:
+   __radd__= __add__
+
+   def __len__(self):
+      return self.n
+
+   @property
+   def n(self):
+      """Total number of samples."""
+      return int(self.counts.sum())
+
+   @property
+   def speeds(self):
+      """Speed of every bin."""
+      return np.arange(len(self.counts)) / self.bins_per_unit
+
+   def _index_sum(self, p):
+      # Exact sum of counts * index**p over all bins, as a Python integer.
+      nonzero= np.flatnonzero(self.counts)
+      return sum(int(c) * int(i) ** p
+        for i, c in zip(nonzero, self.counts[nonzero]))
+
+   def moment(self, p):
+      """
+      OVERVIEW
+
+      This method returns the `p`-th raw moment (mean of speed**p) for a
+      non-negative integer `p`.
+      """
+
+      return (self._index_sum(p) / self.n) / self.bins_per_unit ** p
+
+   @property
+   def mean(self):
+      return self.moment(1)
+
+   @property
+   def mean_cube(self):
+      return self.moment(3)
+
+   def fraction_below(self, x):
+      """This method returns the fraction of samples strictly below `x`."""
+      below= np.searchsorted(self.speeds, x, side='left')
+      return self.counts[:below].sum() / self.n
+
+   def moment_statistics(self):
+      """
+      OVERVIEW
+
+      This method returns the `(mean, meanCube, cumulative)` triple of
+      `main.py` (see `weibull.moment_statistics`).
+      """
+
+      mean= self.mean
+      return mean, self.mean_cube, self.fraction_below(mean)
+
+   def quantile(self, q):
+      """
+      OVERVIEW
+
+      This method returns the empirical quantile(s) `q` (in [0, 1]) with the
+      linear interpolation used by `numpy.quantile`, i.e. the same result as
+      `numpy.quantile` applied to the unbinned samples.
+      """
+
+      q= np.asarray(q, dtype=np.float64)
+      if np.any((q < 0.0) | (q > 1.0)):
+         raise ValueError("Quantiles must be in the interval [0, 1].")
+
+      cum= np.cumsum(self.counts)
+      speeds= self.speeds
+      position= q * (self.n - 1)
+      lo= np.floor(position)
+      frac= position - lo
+
+      # Order statistic j (0-based) lies in the first bin with cum > j:
+      x_lo= speeds[np.searchsorted(cum, lo, side='right')]
+      x_hi= speeds[np.searchsorted(cum, np.minimum(lo + 1, self.n - 1),
+        side='right')]
+      return x_lo + frac * (x_hi - x_lo)
+
+   def fit_moments(self, a=0.1, b=100.0, ftol=1.e-6, xtol=1.e-6,
+     solver=find_root_bisection):
+      """This method returns the moment-fit Weibull `(k, c)`."""
+      return weibull.fit_moments(*self.moment_statistics(), a=a, b=b,
+        ftol=ftol, xtol=xtol, solver=solver)
+
+   def fit_ml(self, a=0.1, b=100.0, ftol=1.e-9, xtol=1.e-6,
+     solver=find_root_bisection):
+      """
+      OVERVIEW
+
+      This method returns the ML Weibull `(k, c)`.  The zero-speed bin is
+      excluded, since the Weibull likelihood vanishes there.
+      """
+
+      nonzero= np.flatnonzero(self.counts)
+      nonzero= nonzero[nonzero > 0]
+      return weibull.fit_ml(nonzero / self.bins_per_unit, self.counts[nonzero],
+        a=a, b=b, ftol=ftol, xtol=xtol, solver=solver)
+
+# end class SpeedHistogram
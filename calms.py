@@ -0,0 +1,277 @@
+"""
+calms.py
+
+
+OVERVIEW
+
+This module fits a Weibull distribution that treats calm readings separately.
+Readings at or below a threshold u are calm, and their fraction p0 is a point
+mass; readings above u follow a Weibull distribution (k, c) truncated at u:
+
+   F(v)= p0                                            for v <= u
+   F(v)= p0 + (1 - p0) (W(v) - W(u)) / (1 - W(u))      for v > u
+
+where W(v)= 1 - exp(-(v/c)^k).  With u= 0 this is the 'weibull_calm' model of
+`fitting.py`.  Folding calm readings into a plain Weibull fit, as the moment
+fit of `main.py` does, lowers k; the mixture keeps them out of (k, c).
+
+The choice of u matters, so `fit_thresholds` fits many thresholds at once
+for sensitivity studies.  The sample is reduced once to its distinct speeds
+and their counts (or taken from a `binned.SpeedHistogram`).  Reverse
+cumulative sums over the distinct speeds then give the statistics of the
+readings above every threshold at once, and the equations of all thresholds
+are solved together with `find_roots_nd.find_root_newton_batch`.
+
+Two methods are available:
+
+   'ml'        maximum likelihood of the truncated Weibull.  The scale follows
+               from the shape as c^k= mean(x^k - u^k), and k solves
+
+                  g(k)= T(k) / S(k) - 1/k - mean(ln x)= 0,
+                  S(k)= sum(x^k - u^k),  T(k)= sum(x^k ln x - u^k ln u),
+
+               over the n readings x above u; for u= 0 this is the ML
+               equation of `weibull.ml_equation`.
+   'moments'   the moment equation of `main.py`, applied to the readings
+               above u as if they were an untruncated Weibull sample.  This
+               is a reasonable approximation only for u at or near the
+               resolution of the readings.
+"""
+
+import collections
+import math
+
+import numpy as np
+
+from find_roots_nd import find_root_newton_batch
+
+METHODS= ('ml', 'moments')
+
+CalmFit= collections.namedtuple('CalmFit',
+  ['threshold', 'p0', 'k', 'c', 'n', 'converged'])
+
+_lgamma= np.frompyfunc(math.lgamma, 1, 1)
+
+
+def _distinct(sample):
+   # Distinct speeds and their counts, from raw speeds or a histogram.
+   if hasattr(sample, 'bins_per_unit'):
+      nonzero= np.flatnonzero(sample.counts)
+      return nonzero / sample.bins_per_unit, sample.counts[nonzero]
+   speeds= np.asarray(sample, dtype=np.float64)
+   speeds= speeds[np.isfinite(speeds)]
+   return np.unique(speeds, return_counts=True)
+
+
+class ThresholdStatistics(object):
+   """
+   OVERVIEW
+
+   Statistics of the readings above each of several thresholds, computed in
+   one pass over the distinct speeds of a sample.
+
+   INPUTS
+
+   `sample` is an array of speeds or a `binned.SpeedHistogram`.
+
+   `thresholds` is an array of calm thresholds u.
+
+   ATTRIBUTES
+
+   `values`, `counts`: distinct speeds and their counts.
+
+   `first`: index into `values` of the first speed above every threshold.
+
+   `n`, `p0`: number of readings above, and fraction at or below, every
+   threshold.
+
+   `mean`, `mean_square`, `mean_cube`, `mean_log`: mean, mean square, mean
+   cube and mean logarithm of the readings above every threshold.
+   """
+
+   def __init__(self, sample, thresholds):
+      self.values, self.counts= _distinct(sample)
+      self.thresholds= np.atleast_1d(np.asarray(thresholds, dtype=np.float64))
+      if len(self.values) == 0:
+         raise ValueError("The sample is empty.")
+      if np.any(self.thresholds < 0.0):
+         raise ValueError("Thresholds must not be negative.")
+
+      # Sums over values[i:] for every i, and the total:
+      def tail(terms):
+         return np.r_[np.cumsum(terms[::-1])[::-1], 0.0]
+
+      self.first= np.searchsorted(self.values, self.thresholds, side='right')
+      total= self.counts.sum()
+      counts= self.counts.astype(np.float64)
+      self.n= tail(counts)[self.first].astype(np.int64)
+      self.p0= 1.0 - self.n / total
+
+      # Speeds relative to the largest one, which keeps x^k finite for large
+      # k and leaves g(k) unchanged:
+      self.top= self.values[-1]
+      positive= self.values > 0.0
+      self.log_values= np.full(len(self.values), -np.inf)
+      self.log_values[positive]= np.log(self.values[positive] / self.top)
+
+      with np.errstate(invalid='ignore', divide='ignore'):
+         self.mean= tail(counts * self.values)[self.first] / self.n
+         self.mean_square= tail(counts * self.values ** 2)[self.first] / (
+           self.n)
+         self.mean_cube= tail(counts * self.values ** 3)[self.first] / self.n
+         self.mean_log= tail(np.where(positive, counts * self.log_values,
+           0.0))[self.first] / self.n + math.log(self.top)
+
+   def cumulative(self):
+      """
+      OVERVIEW
+
+      This method returns, for every threshold, the fraction of the readings
+      above it that are strictly below their mean (the `cumulative` of
+      `main.py`).
+      """
+
+      below= np.searchsorted(self.values, self.mean, side='left')
+      head= np.r_[0, np.cumsum(self.counts)]
+      return (head[np.maximum(below, self.first)] - head[self.first]) / self.n
+
+# end class ThresholdStatistics
+
+
+def _ml_equation(stats, K, rows):
+   # g(k) of the truncated ML fit for thresholds `rows` at shapes K[:, 0].
+   k= K[:, 0:1]
+   first= stats.first[rows, None]
+   above= np.arange(len(stats.values)) >= first
+   log_u= np.full(len(rows), -np.inf)
+   positive= stats.thresholds[rows] > 0.0
+   log_u[positive]= np.log(stats.thresholds[rows][positive] / stats.top)
+
+   with np.errstate(all='ignore'):
+      w= np.where(above, stats.counts * np.exp(k * stats.log_values), 0.0)
+      u_k= np.exp(k[:, 0] * log_u)
+      n= stats.n[rows]
+      S= w.sum(axis=1) - n * u_k
+      T= np.where(above, w * stats.log_values, 0.0).sum(axis=1) - n * np.where(
+        positive, u_k * log_u, 0.0)
+      g= T / S - 1.0 / k[:, 0] - (stats.mean_log[rows] - math.log(stats.top))
+   g[~(k[:, 0] > 0.0)]= np.nan
+   return g[:, None]
+
+
+def _ml_scale(stats, k):
+   log_u= np.full(len(k), -np.inf)
+   positive= stats.thresholds > 0.0
+   log_u[positive]= np.log(stats.thresholds[positive] / stats.top)
+   above= np.arange(len(stats.values)) >= stats.first[:, None]
+   with np.errstate(all='ignore'):
+      w= np.where(above, stats.counts * np.exp(k[:, None] * stats.log_values),
+        0.0)
+      S= w.sum(axis=1) - stats.n * np.exp(k * log_u)
+      return stats.top * (S / stats.n) ** (1.0 / k)
+
+
+def _moment_equation(stats, cumulative, K, rows):
+   # The moment equation of `main.py` for thresholds `rows`, vectorized.
+   k= K[:, 0]
+   with np.errstate(all='ignore'):
+      gamma3= np.exp(_lgamma(1.0 + 3.0 / k).astype(np.float64))
+      f= cumulative[rows] + np.exp(-(stats.mean[rows] / (stats.mean_cube[rows]
+        / gamma3) ** (1.0 / 3.0)) ** k) - 1.0
+   f[~(k > 0.0)]= np.nan
+   return f[:, None]
+
+
+def _start(stats):
+   # Shape from the coefficient of variation of the readings above each
+   # threshold (Justus' approximation), a good starting point for Newton.
+   with np.errstate(all='ignore'):
+      cv= np.sqrt(np.maximum(stats.mean_square - stats.mean ** 2, 0.0)) / (
+        stats.mean)
+      k0= cv ** -1.086
+   return np.where(np.isfinite(k0) & (k0 > 0.0), np.clip(k0, 0.2, 50.0), 2.0)
+
+
+def fit_thresholds(sample, thresholds, method='ml', xtol=1.e-9, ftol=1.e-9,
+  min_count=10):
+   """
+   OVERVIEW
+
+   This function fits the calm mixture for every calm threshold in
+   `thresholds` and returns a `CalmFit` of arrays, one element per threshold:
+   the threshold, the calm fraction `p0`, the Weibull parameters `k` and `c`
+   of the readings above the threshold, their number `n`, and whether the
+   solver converged.  Thresholds leaving fewer than `min_count` readings, or
+   fewer than two distinct speeds, above them get NaN parameters.
+
+   INPUTS
+
+   `sample` is an array of speeds or a `binned.SpeedHistogram`.
+
+   `method` is one of `METHODS`.
+
+   `xtol` and `ftol` are passed to `find_roots_nd.find_root_newton_batch`.
+   """
+
+   if method not in METHODS:
+      raise ValueError("`method` must be one of %s." % ', '.join(METHODS))
+
+   stats= ThresholdStatistics(sample, thresholds)
+   m= len(stats.thresholds)
+   k= np.full(m, np.nan)
+   c= np.full(m, np.nan)
+   converged= np.zeros(m, dtype=bool)
+
+   solvable= np.flatnonzero((stats.n >= max(min_count, 1)) &
+     (stats.first < len(stats.values) - 1) & (stats.values[-1] > 0.0))
+   if len(solvable):
+      if method == 'ml':
+         def F(K, rows):
+            return _ml_equation(stats, K, solvable[rows])
+      else:
+         cumulative= stats.cumulative()
+
+         def F(K, rows):
+            return _moment_equation(stats, cumulative, K, solvable[rows])
+
+      K, ok= find_root_newton_batch(F, _start(stats)[solvable, None],
+        xtol=xtol, ftol=ftol, full_output=True)[:2]
+      k[solvable]= K[:, 0]
+      converged[solvable]= ok
+
+      if method == 'ml':
+         c[solvable]= _ml_scale(stats, k)[solvable]
+      else:
+         with np.errstate(invalid='ignore'):
+            c[solvable]= stats.mean[solvable] / np.exp(_lgamma(1.0 + 1.0 /
+              k[solvable]).astype(np.float64))
+
+   return CalmFit(stats.thresholds, stats.p0, k, c, stats.n, converged)
+
+
+def cdf(x, threshold, p0, k, c):
+   """
+   OVERVIEW
+
+   This function returns the CDF of the calm mixture at the speeds `x`.
+   """
+
+   x= np.asarray(x, dtype=np.float64)
+   with np.errstate(over='ignore'):
+      survival= np.exp((threshold / c) ** k - (np.maximum(x, threshold) / c)
+        ** k)
+   return np.where(x < 0.0, 0.0, 1.0 - (1.0 - p0) * survival)
+
+
+def format_table(fit):
+   """
+   OVERVIEW
+
+   This function renders a `CalmFit` as a text table, one row per threshold.
+   """
+
+   lines= ['%10s %8s %10s %10s %10s' % ('threshold', 'p0', 'k', 'c', 'n')]
+   for threshold, p0, k, c, n, ok in zip(*fit):
+      lines.append('%10.3f %8.4f %10.5f %10.5f %10d%s' % (threshold, p0, k, c,
+        n, '' if ok else '  (not converged)'))
+   return '\n'.join(lines)
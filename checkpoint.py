@@ -0,0 +1,405 @@
+"""
+checkpoint.py
+
+
+OVERVIEW
+
+This module makes long batch jobs, such as fitting every station, every year
+and every bootstrap replicate of a fleet, restartable.  The job is split into
+work units with string keys.  When a unit finishes, its result (k, c and the
+solver statistics) is appended to a journal file.  After a crash or an
+interruption, running the same job again skips every unit already in the
+journal, so only the unfinished units are computed.
+
+A unit whose fit fails, e.g. with `AlgorithmFailure` from a solver, is
+recorded in the journal as failed, with the error message, and the job moves
+on to the next unit.  Failed units are skipped on restart as well, unless
+`retry_failed` is set.
+
+The journal is a text file with one JSON record per line, flushed and synced
+after every record.  A record cut short by a crash is ignored when the journal
+is read, and the unit is computed again.  If a unit appears more than once
+(after a retry), the last record counts.
+
+   journal= Journal('fleet.jsonl')
+   results= run_batch(units, work, journal)
+
+`fit_fleet` is such a job for station files, and running the module as a
+script runs it.  A journal belongs to one set of fit settings; resuming it
+with others is refused.
+
+   python checkpoint.py station1.txt station2.txt --journal fleet.jsonl \\
+     --by-year --bootstrap 100
+"""
+
+import argparse
+import hashlib
+import inspect
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+import weibull
+from find_roots import AlgorithmFailure
+from result_cache import SOLVERS, counting_solver
+from wind_data import read_station
+
+# Exceptions that mark a unit as failed rather than stopping the job:
+FAILURES= (AlgorithmFailure, ArithmeticError, ValueError)
+
+
+def unit_key(*parts):
+   """
+   OVERVIEW
+
+   This function returns a journal key for a unit identified by `parts`
+   (strings and numbers), e.g. `unit_key('input.txt', 2020, 7)`.
+   """
+
+   return json.dumps(list(parts), separators=(',', ':'))
+
+
+# Journal key of the settings record of `fit_fleet`:
+SETTINGS_UNIT= unit_key('settings')
+
+
+class Journal(object):
+   """
+   OVERVIEW
+
+   An append-only record of completed work units.
+
+   INPUTS
+
+   `path` is the journal file; it is created on the first record.
+
+   `sync`: if `True`, every record is forced to disk with `os.fsync`, so that
+   it survives a crash of the machine and not only of the process.
+   """
+
+   def __init__(self, path, sync=True):
+      self.path= path
+      self.sync= sync
+
+   def read(self):
+      """
+      OVERVIEW
+
+      This method returns a dict from unit key to the last record of that
+      unit.  Lines that cannot be parsed, such as a record cut short by a
+      crash, are skipped.
+      """
+
+      records= {}
+      try:
+         with open(self.path, 'rt') as journalfile:
+            for line in journalfile:
+               try:
+                  record= json.loads(line)
+               except ValueError:
+                  continue
+               if isinstance(record, dict) and 'unit' in record:
+                  records[record['unit']]= record
+      except (IOError, OSError):
+         pass
+      return records
+
+   def append(self, record):
+      """This method appends the dict `record` to the journal."""
+      line= json.dumps(record, separators=(',', ':'), sort_keys=True)
+      with open(self.path, 'at') as journalfile:
+         # A previous run may have died in the middle of a line:
+         if journalfile.tell() > 0 and not self._ends_with_newline():
+            journalfile.write('\n')
+         journalfile.write(line + '\n')
+         journalfile.flush()
+         if self.sync:
+            os.fsync(journalfile.fileno())
+
+   def _ends_with_newline(self):
+      with open(self.path, 'rb') as journalfile:
+         journalfile.seek(-1, os.SEEK_END)
+         return journalfile.read(1) == b'\n'
+
+   def record_result(self, unit, result):
+      """
+      OVERVIEW
+
+      This method records that `unit` finished with the dict `result`, and
+      returns the record.
+      """
+
+      record= {'unit': unit, 'status': 'ok', 'result': result,
+        'time': time.time()}
+      self.append(record)
+      return record
+
+   def record_failure(self, unit, error):
+      """
+      OVERVIEW
+
+      This method records that `unit` failed with the exception `error`, and
+      returns the record.
+      """
+
+      record= {'unit': unit, 'status': 'failed', 'error': type(error).__name__,
+        'message': str(error), 'time': time.time()}
+      self.append(record)
+      return record
+
+   def compact(self):
+      """
+      OVERVIEW
+
+      This method rewrites the journal with only the last record of every
+      unit, atomically.
+      """
+
+      records= self.read()
+      directory= os.path.dirname(os.path.abspath(self.path))
+      handle, temporary= tempfile.mkstemp(dir=directory, suffix='.tmp')
+      try:
+         with os.fdopen(handle, 'wt') as journalfile:
+            for record in records.values():
+               journalfile.write(json.dumps(record, separators=(',', ':'),
+                 sort_keys=True) + '\n')
+         os.replace(temporary, self.path)
+      except BaseException:
+         os.remove(temporary)
+         raise
+
+# end class Journal
+
+
+def run_batch(units, work, journal, retry_failed=False, failures=FAILURES,
+  verbose=False, done=None):
+   """
+   OVERVIEW
+
+   This function runs `work(unit)` for every key in `units` that the
+   `Journal` `journal` does not already hold, records every outcome, and
+   returns a dict from unit key to record for all of `units`.
+
+   INPUTS
+
+   `work` returns a JSON-serializable dict for a unit key, or raises one of
+   `failures`, which marks the unit as failed.  Any other exception (and
+   KeyboardInterrupt) stops the job; the units finished so far stay in the
+   journal.
+
+   `retry_failed`: if `True`, units recorded as failed are run again.
+
+   `done` is the dict of `journal.read()`, if the caller has already read the
+   journal; by default the journal is read here.
+   """
+
+   if done is None:
+      done= journal.read()
+   results= {}
+   skipped= 0
+
+   for unit in units:
+      record= done.get(unit)
+      if record is not None and (record['status'] == 'ok' or not
+        retry_failed):
+         results[unit]= record
+         skipped+= 1
+         continue
+
+      try:
+         result= work(unit)
+      except failures as error:
+         results[unit]= journal.record_failure(unit, error)
+         if verbose:
+            print('%s failed: %s' % (unit, error))
+      else:
+         results[unit]= journal.record_result(unit, result)
+
+   if verbose:
+      print('%d units, %d taken from the journal.' % (len(results), skipped))
+   return results
+
+
+def fit_speeds(speeds, method='moments', solver='bisection', a=0.1, b=100.0,
+  xtol=1.e-6, ftol=1.e-6):
+   """
+   OVERVIEW
+
+   This function fits the Weibull distribution to `speeds` and returns a
+   journal result: a dict with keys 'k', 'c', 'n' (number of samples),
+   'calls' (objective evaluations made by the solver) and 'seconds'.
+
+   `method` is 'moments' (the fit of `main.py`) or 'ml' (calm readings are
+   left out); `solver` is a key of `result_cache.SOLVERS`, and `a`, `b`,
+   `xtol` and `ftol` are passed to it.
+   """
+
+   if solver not in SOLVERS:
+      raise ValueError("`solver` must be one of %s."
+        % ', '.join(sorted(SOLVERS)))
+
+   start= time.perf_counter()
+   calls= [0]
+   speeds= np.asarray(speeds, dtype=np.float64)
+   if len(speeds) == 0:
+      raise ValueError("No samples to fit.")
+
+   if method == 'moments':
+      k, c= weibull.fit_moments(*weibull.moment_statistics(speeds), a=a, b=b,
+        xtol=xtol, ftol=ftol, solver=counting_solver(solver, calls))
+   elif method == 'ml':
+      k, c= weibull.fit_ml(speeds[speeds > 0.0], a=a, b=b, xtol=xtol,
+        ftol=ftol, solver=counting_solver(solver, calls))
+   else:
+      raise ValueError("`method` must be 'moments' or 'ml'.")
+
+   return {'k': float(k), 'c': float(c), 'n': int(len(speeds)),
+     'calls': calls[0], 'seconds': time.perf_counter() - start}
+
+
+def unit_seed(unit):
+   """
+   OVERVIEW
+
+   This function returns an integer seed for the string `unit`, such as a
+   unit key, that is stable across runs and platforms (unlike `hash`).
+   """
+
+   return int.from_bytes(hashlib.sha256(unit.encode('utf-8')).digest()[:8],
+     'little')
+
+
+def fit_fleet(paths, journal, by_year=False, bootstrap=0, seed=0,
+  retry_failed=False, verbose=False, **fit_options):
+   """
+   OVERVIEW
+
+   This function fits every station file in `paths`, journaling every unit
+   in the `Journal` `journal`, and returns the dict of records of
+   `run_batch`.
+
+   INPUTS
+
+   `by_year`: if `True`, every calendar year of every station is a unit of
+   its own; otherwise, the whole record is.
+
+   `bootstrap` is the number of bootstrap replicates per station (or
+   station-year), in addition to the fit of the data itself.  Every
+   replicate resamples with a seed derived from `seed` and its unit key
+   (station, window and replicate), so replicates of different stations and
+   windows are independent, and a restarted job draws the same samples.
+
+   `fit_options` are passed to `fit_speeds`.
+
+   Unit keys are `unit_key(path, window, replicate)`, where `window` is the
+   year or 'all' and `replicate` is 0 for the data itself.  With `by_year`,
+   the years of every station are journaled as well, under
+   `unit_key(path, 'years')`, so that a station file is read again only if
+   some of its units are unfinished.
+
+   The seed and the fit settings (`fit_options`, with the defaults of
+   `fit_speeds` filled in) are journaled under `SETTINGS_UNIT` when the job
+   starts.  Resuming a journal written with other settings raises
+   `ValueError`, rather than returning results of a different fit.
+   """
+
+   settings= {name: parameter.default for name, parameter in
+     inspect.signature(fit_speeds).parameters.items()
+     if parameter.default is not parameter.empty}
+   settings.update(fit_options, seed=seed)
+   settings= json.loads(json.dumps(settings))
+
+   done= journal.read()
+   if SETTINGS_UNIT in done:
+      if done[SETTINGS_UNIT]['result'] != settings:
+         raise ValueError("The journal %s was written with the settings %s, "
+           "not %s; use another journal." % (journal.path,
+           json.dumps(done[SETTINGS_UNIT]['result'], sort_keys=True),
+           json.dumps(settings, sort_keys=True)))
+   elif done:
+      raise ValueError("The journal %s has no settings record; use another "
+        "journal." % journal.path)
+   else:
+      journal.record_result(SETTINGS_UNIT, settings)
+   results= {}
+
+   for path in paths:
+      series= None
+      listing= unit_key(path, 'years')
+      if not by_year:
+         windows= ['all']
+      elif listing in done:
+         windows= done[listing]['result']['years']
+      else:
+         series= read_station(path)
+         windows= [int(year) for year in np.unique(series.year)]
+         journal.record_result(listing, {'years': windows})
+
+      units= [unit_key(path, window, replicate) for window in windows
+        for replicate in range(bootstrap + 1)]
+      pending= [unit for unit in units if unit not in done or (retry_failed
+        and done[unit]['status'] != 'ok')]
+      results.update((unit, done[unit]) for unit in units if unit in done)
+      if not pending:
+         continue
+
+      if series is None:
+         series= read_station(path)
+      years= series.year if by_year else None
+
+      def work(unit):
+         _, window, replicate= json.loads(unit)
+         speeds= series.speed if window == 'all' else series.speed[years ==
+           window]
+         if replicate:
+            rng= np.random.default_rng([seed, unit_seed(unit)])
+            speeds= speeds[rng.integers(0, len(speeds), len(speeds))]
+         return fit_speeds(speeds, **fit_options)
+
+      results.update(run_batch(pending, work, journal, retry_failed,
+        verbose=verbose, done=done))
+
+   return results
+
+
+def main(argv=None):
+   parser= argparse.ArgumentParser(description="Fit station files with a "
+     "journal, so that an interrupted run can be resumed.")
+   parser.add_argument('paths', nargs='+', help="station files")
+   parser.add_argument('--journal', default='fleet.jsonl',
+     help="journal file (default: %(default)s)")
+   parser.add_argument('--by-year', action='store_true',
+     help="fit every calendar year separately")
+   parser.add_argument('--bootstrap', type=int, default=0,
+     help="bootstrap replicates per unit")
+   parser.add_argument('--seed', type=int, default=0)
+   parser.add_argument('--method', choices=('moments', 'ml'),
+     default='moments')
+   parser.add_argument('--solver', choices=sorted(SOLVERS),
+     default='bisection')
+   parser.add_argument('--retry-failed', action='store_true',
+     help="run units recorded as failed again")
+   args= parser.parse_args(argv)
+
+   start= time.perf_counter()
+   try:
+      results= fit_fleet(args.paths, Journal(args.journal), args.by_year,
+        args.bootstrap, args.seed, args.retry_failed, method=args.method,
+        solver=args.solver)
+   except ValueError as error:
+      parser.error(str(error))
+   failed= [record for record in results.values() if record['status'] !=
+     'ok']
+
+   print('%d units (%d failed) in %.2f s; journal: %s' % (len(results),
+     len(failed), time.perf_counter() - start, args.journal))
+   for record in failed:
+      print('   %s: %s: %s' % (record['unit'], record['error'],
+        record['message']))
+
+
+if __name__ == '__main__':
+   main()
@@ -0,0 +1,329 @@
+"""
+extremes.py
+
+
+OVERVIEW
+
+This module estimates extreme wind speeds, such as the 50-year return-period
+speed used for design loads.
+
+   block_maxima        annual or monthly maxima of a record
+   block_maxima_batch  the same for many stations in one pass
+   decluster           independent storm peaks over a threshold
+   fit_gumbel          ML fit of the Gumbel distribution
+   fit_gev             ML fit of the generalized extreme value distribution
+   fit_gumbel_batch    the same fits for many stations at once
+   fit_gev_batch
+   return_level        speed exceeded once per return period, on average
+
+Maxima are taken with `numpy.maximum.reduceat` over the runs of equal year
+(or month) of the timestamps, so no Python loop over rows is needed; batches of
+stations are concatenated with a per-station block key and reduced in the same
+single call.  Storm peaks are separated with a vectorized declustering pass:
+exceedances of the threshold that are less than `separation` seconds apart
+belong to the same storm, and each storm contributes its highest speed.
+
+The Gumbel ML fit reduces to one equation in the scale parameter, which is
+solved with `find_roots.find_root`.  The GEV ML fit solves the three score
+equations with Newton's method.  The batch variants, and `fit_gev`, solve the
+equations of all stations together with `find_roots_nd.find_root_newton_batch`,
+which evaluates the equations once per iteration for every unfinished station.
+
+The GEV is parametrized as in Coles (2001), with location mu, scale sigma and
+shape xi:
+
+   F(x)= exp(-(1 + xi (x - mu) / sigma)^(-1/xi))
+
+xi < 0 gives a bounded upper tail (Weibull type), xi > 0 a heavy tail
+(Frechet type); the Gumbel distribution is the limit xi -> 0.
+"""
+
+import math
+
+import numpy as np
+
+from find_roots import AlgorithmFailure, find_root
+from find_roots_nd import find_root_newton_batch
+
+# Shape parameters closer to zero than this are treated as the Gumbel limit in
+# `return_level`:
+_GUMBEL_LIMIT= 1.e-9
+
+
+def _block_keys(time, block):
+   # Integer year or month number of every timestamp.
+   time= np.asarray(time, dtype=np.int64).astype('datetime64[s]')
+   if block == 'year':
+      return time.astype('datetime64[Y]').astype(np.int64) + 1970
+   if block == 'month':
+      return time.astype('datetime64[M]').astype(np.int64)
+   raise ValueError("`block` must be 'year' or 'month'.")
+
+
+def _reduce_runs(keys, values):
+   # Maximum and count of `values` over every run of equal `keys`.
+   starts= np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if len(
+     keys) else np.empty(0, np.int64)
+   if len(starts) == 0:
+      return starts, np.empty(0), starts
+   maxima= np.maximum.reduceat(values, starts)
+   counts= np.diff(np.r_[starts, len(keys)])
+   return starts, maxima, counts
+
+
+def block_maxima(series, block='year', min_count=0):
+   """
+   OVERVIEW
+
+   This function returns `(keys, maxima, counts)` for the `WindSeries`
+   `series`: the year (or, with `block='month'`, the month number counted
+   from January 1970) of every block, the highest speed in it, and the number
+   of samples in it.  Blocks with fewer than `min_count` samples, such as
+   incomplete first and last years, are dropped.  Samples must be in time
+   order.
+   """
+
+   keys= _block_keys(series.time, block)
+   starts, maxima, counts= _reduce_runs(keys, series.speed)
+   keep= counts >= min_count
+   return keys[starts][keep], maxima[keep], counts[keep]
+
+
+def block_maxima_batch(series_list, block='year', min_count=0):
+   """
+   OVERVIEW
+
+   This function returns `block_maxima` for every `WindSeries` in
+   `series_list`, as a list of `(keys, maxima, counts)` tuples, using a single
+   reduction over all stations.
+   """
+
+   lengths= [len(series) for series in series_list]
+   if not lengths:
+      return []
+
+   station= np.repeat(np.arange(len(lengths)), lengths)
+   time= np.concatenate([series.time for series in series_list])
+   speed= np.concatenate([series.speed for series in series_list])
+   keys= _block_keys(time, block)
+
+   # Combine station and block into one key, so that blocks never span two
+   # stations:
+   span= int(keys.max() - keys.min()) + 1 if len(keys) else 1
+   starts, maxima, counts= _reduce_runs(station * span + (keys - keys.min()),
+     speed)
+
+   block_station= station[starts]
+   block_keys= keys[starts]
+   keep= counts >= min_count
+   bounds= np.searchsorted(block_station[keep], np.arange(len(lengths) + 1))
+   return [(block_keys[keep][lo:hi], maxima[keep][lo:hi],
+     counts[keep][lo:hi]) for lo, hi in zip(bounds[:-1], bounds[1:])]
+
+
+def decluster(series, threshold, separation=48 * 3600):
+   """
+   OVERVIEW
+
+   This function returns `(time, peak)` arrays of independent storm peaks of
+   the `WindSeries` `series`: exceedances of `threshold` closer together than
+   `separation` seconds are grouped into one storm, represented by its highest
+   speed and the time at which it occurred.  Samples must be in time order.
+   """
+
+   exceed= np.flatnonzero(series.speed > threshold)
+   if len(exceed) == 0:
+      return np.empty(0, np.int64), np.empty(0)
+
+   time= series.time[exceed]
+   speed= series.speed[exceed]
+   storm= np.cumsum(np.r_[True, np.diff(time) > separation]) - 1
+
+   # Within every storm, the first sample with the highest speed:
+   order= np.lexsort((-speed, storm))
+   first= order[np.r_[True, storm[order][1:] != storm[order][:-1]]]
+   return time[first], speed[first]
+
+
+def _as_matrix(samples):
+   # Pads a list of 1-D arrays into an m-by-L array with NaN.
+   samples= [np.asarray(s, dtype=np.float64) for s in samples]
+   X= np.full((len(samples), max([len(s) for s in samples] or [0])), np.nan)
+   for row, s in enumerate(samples):
+      X[row, :len(s)]= s
+   return X
+
+
+def _gumbel_equation(X, beta):
+   # ML equation for the Gumbel scale of every row of X (NaN = missing):
+   # beta - mean(x) + sum(x exp(-x/beta)) / sum(exp(-x/beta)).
+   present= np.isfinite(X)
+   top= np.nanmax(X, axis=1, keepdims=True)
+   with np.errstate(over='ignore', invalid='ignore'):
+      w= np.where(present, np.exp(-(X - top) / beta[:, None]), 0.0)
+      x= np.where(present, X, 0.0)
+      mean= x.sum(axis=1) / present.sum(axis=1)
+      return beta - mean + (w * x).sum(axis=1) / w.sum(axis=1)
+
+
+def _gumbel_location(X, beta):
+   present= np.isfinite(X)
+   top= np.nanmax(X, axis=1)
+   with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+      w= np.where(present, np.exp(-(X - top[:, None]) / beta[:, None]), 0.0)
+      return top - beta * np.log(w.sum(axis=1) / present.sum(axis=1))
+
+
+def _gumbel_start(X):
+   # Method-of-moments scale, sqrt(6) std / pi.
+   return np.sqrt(6.0) * np.nanstd(X, axis=1) / math.pi
+
+
+def fit_gumbel(maxima, xtol=1.e-9, ftol=1.e-9):
+   """
+   OVERVIEW
+
+   This function returns the ML Gumbel parameters `(mu, beta)` of the sample
+   `maxima`, with F(x)= exp(-exp(-(x - mu) / beta)).
+   """
+
+   X= _as_matrix([maxima])
+   if np.count_nonzero(np.isfinite(X)) < 2 or np.nanstd(X) == 0.0:
+      raise ValueError("At least two distinct maxima are needed.")
+
+   beta0= _gumbel_start(X)[0]
+   beta= find_root(lambda beta: _gumbel_equation(X, np.array([beta]))[0],
+     0.5 * beta0, 2.0 * beta0, xtol=xtol * beta0, ftol=ftol * beta0)
+   return float(_gumbel_location(X, np.array([beta]))[0]), float(beta)
+
+
+def fit_gumbel_batch(samples, xtol=1.e-9, ftol=1.e-9, full_output=False):
+   """
+   OVERVIEW
+
+   This function fits the Gumbel distribution to every array in `samples`
+   (e.g. the annual maxima of many stations) and returns an m-by-2 array of
+   `(mu, beta)` rows.  `full_output` is passed to
+   `find_roots_nd.find_root_newton_batch`; with it, the function returns
+   `(params, converged)`.
+   """
+
+   X= _as_matrix(samples)
+   beta0= _gumbel_start(X)
+
+   result= find_root_newton_batch(
+     lambda P, rows: _gumbel_equation(X[rows], P[:, 0])[:, None],
+     beta0[:, None], xtol=xtol, ftol=ftol, full_output=full_output)
+   beta= (result[0] if full_output else result)[:, 0]
+   params= np.column_stack([_gumbel_location(X, beta), beta])
+   return (params, result[1]) if full_output else params
+
+
+def _gev_score(X, P):
+   # Gradient of the GEV log-likelihood, divided by the number of samples, for
+   # every row of X (NaN = missing) at parameters P[:, (mu, sigma, xi)].
+   mu, sigma, xi= P[:, 0:1], P[:, 1:2], P[:, 2:3]
+   present= np.isfinite(X)
+   n= present.sum(axis=1)
+
+   with np.errstate(all='ignore'):
+      z= np.where(present, (X - mu) / sigma, 0.0)
+      y= 1.0 + xi * z
+      log_y= np.log(y)
+      t= np.exp(-log_y / xi)
+      a= np.where(present, (1.0 + xi - t) / y, 0.0)
+
+      d_mu= a.sum(axis=1) / sigma[:, 0]
+      d_sigma= (-n + (z * a).sum(axis=1)) / sigma[:, 0]
+      d_xi= np.where(present, log_y / xi**2 * (1.0 - t) -
+        (1.0 + 1.0 / xi) * z / y + t * z / (xi * y), 0.0).sum(axis=1)
+      score= np.column_stack([d_mu, d_sigma, d_xi]) / n[:, None]
+
+   # Outside the support (some y <= 0) or for sigma <= 0 the score is
+   # undefined; NaN makes the solvers' line search step back.
+   invalid= (sigma[:, 0] <= 0.0) | np.any(present & ~(y > 0.0), axis=1)
+   score[invalid]= np.nan
+   return score
+
+
+def _gev_start(X):
+   # Gumbel fit with a small positive shape, avoiding the xi= 0 singularity of
+   # the score equations, and whether the Gumbel fit converged.  Rows where
+   # it did not (e.g. a single or constant maximum) cannot be fitted.
+   params, converged= fit_gumbel_batch([row[np.isfinite(row)] for row in X],
+     full_output=True)
+   return np.column_stack([params, np.full(len(X), 0.01)]), converged
+
+
+def fit_gev(maxima, p0=None, xtol=1.e-9, ftol=1.e-9):
+   """
+   OVERVIEW
+
+   This function returns the ML GEV parameters `(mu, sigma, xi)` of the sample
+   `maxima`, solving the score equations with Newton's method.  `p0` is the
+   starting point; by default, the Gumbel fit with xi= 0.01.  Small samples
+   (a few decades of annual maxima) may not constrain xi well; the Gumbel fit
+   is then the more robust choice.
+   """
+
+   params= fit_gev_batch([maxima], None if p0 is None else [p0], xtol, ftol)
+   return tuple(float(p) for p in params[0])
+
+
+def fit_gev_batch(samples, p0=None, xtol=1.e-9, ftol=1.e-9,
+  full_output=False):
+   """
+   OVERVIEW
+
+   This function fits the GEV distribution to every array in `samples` and
+   returns an m-by-3 array of `(mu, sigma, xi)` rows.  `p0` is an optional
+   m-by-3 array of starting points.  `full_output` is as for
+   `fit_gumbel_batch`; rows that cannot be fitted, such as a single or
+   constant maximum, are then NaN and marked as not converged.  Otherwise any
+   failure raises `AlgorithmFailure`.
+   """
+
+   X= _as_matrix(samples)
+   if p0 is None:
+      P0, usable= _gev_start(X)
+   else:
+      P0= np.asarray(p0, dtype=np.float64)
+      usable= np.all(np.isfinite(P0), axis=1)
+
+   params= np.full((len(X), 3), np.nan)
+   converged= np.zeros(len(X), dtype=bool)
+   rows= np.flatnonzero(usable)
+   if len(rows):
+      P, ok= find_root_newton_batch(lambda P, r: _gev_score(X[rows[r]], P),
+        P0[rows], xtol=xtol, ftol=ftol, full_output=True)[:2]
+      params[rows]= P
+      converged[rows]= ok
+
+   if full_output:
+      return params, converged
+   if not converged.all():
+      raise AlgorithmFailure("The GEV fit failed for %d of %d samples."
+        % (np.count_nonzero(~converged), len(X)))
+   return params
+
+
+def return_level(params, period, blocks_per_year=1.0):
+   """
+   OVERVIEW
+
+   This function returns the speed exceeded on average once per `period`
+   years (scalar or array), for the Gumbel `(mu, beta)` or GEV `(mu, sigma,
+   xi)` parameters `params` of block maxima.  `blocks_per_year` is 1 for
+   annual and 12 for monthly maxima.
+   """
+
+   period= np.asarray(period, dtype=np.float64)
+   if np.any(period * blocks_per_year <= 1.0):
+      raise ValueError("The return period must exceed one block.")
+
+   mu, sigma= params[0], params[1]
+   xi= params[2] if len(params) > 2 else 0.0
+   y= -np.log1p(-1.0 / (period * blocks_per_year))
+   if abs(xi) < _GUMBEL_LIMIT:
+      return mu - sigma * np.log(y)
+   return mu - sigma / xi * (1.0 - y ** -xi)
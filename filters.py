@@ -0,0 +1,494 @@
+"""
+filters.py
+
+
+OVERVIEW
+
+This module selects subsets of a station record, such as the daytime readings
+of one direction sector in one year, for fitting.  Filters are written either
+as text,
+
+   speed > 0.5 & hour in 8..18 & dir in 240..300 & year == 2020
+
+or built in Python from `Field` objects:
+
+   (Field('speed') > 0.5) & Field('hour').between(8, 18)
+
+Both forms produce the same filter objects.  The fields are the columns of a
+`WindSeries` and the calendar fields derived from its timestamps:
+
+   speed   wind speed
+   dir     wind direction in degrees (`direction` is accepted as well)
+   hour    hour of day, 0-23
+   month   month, 1-12
+   year    calendar year
+
+Conditions are comparisons (<, <=, >, >=, ==, !=) with a number, or ranges
+`field in low..high`, which include both ends.  For `dir` and `hour`, a range
+with low > high wraps around, e.g. `dir in 330..30` or `hour in 20..6`.
+Calm or variable readings (direction 999) satisfy no `dir` condition; select
+them with `~(dir >= 0)`.
+Conditions are combined with `&` (or `and`), `|` (or `or`) and `~` (or
+`not`), and grouped with parentheses; `&` binds more tightly than `|`.
+
+A `MaskCache` evaluates filters against one `WindSeries`.  Every condition is
+computed once into a boolean array and kept, as is every combined filter, so
+that many subsets sharing conditions cost one comparison per distinct
+condition.  Conditions are combined in place into a single result array.  The
+derived calendar columns are also computed only once.
+
+The selected speeds feed the moment fit without being copied, through the
+`where` argument of `weibull.moment_statistics`:
+
+   cache= MaskCache(read_station('input.txt'))
+   k, c= fit_subset(cache, 'speed > 0.5 & year == 2020')
+"""
+
+import re
+
+import numpy as np
+
+import weibull
+from find_roots import find_root_bisection
+
+FIELDS= ('speed', 'dir', 'hour', 'month', 'year')
+
+_ALIASES= {'direction': 'dir'}
+
+# Fields on a circle, for which ranges with low > high wrap around:
+_PERIODIC= ('dir', 'hour')
+
+_OPERATORS= {
+  '<': np.less,
+  '<=': np.less_equal,
+  '>': np.greater,
+  '>=': np.greater_equal,
+  '==': np.equal,
+  '!=': np.not_equal,
+  }
+
+
+def _number(value):
+   # Canonical text of a number, so that 'year == 2020' and 'year == 2020.0'
+   # share one cache entry.
+   value= float(value)
+   return '%d' % value if value.is_integer() else repr(value)
+
+
+class Filter(object):
+   """
+   OVERVIEW
+
+   Base class of filters.  `key` is a canonical text form of the filter,
+   which is used to cache its mask; filters combine with `&`, `|` and `~`.
+   """
+
+   key= None
+
+   def __and__(self, other):
+      return And(self, other)
+
+   def __or__(self, other):
+      return Or(self, other)
+
+   def __invert__(self):
+      return Not(self)
+
+   def __repr__(self):
+      return 'Filter(%r)' % self.key
+
+   def terms(self):
+      """This method returns the conditions that make up the filter."""
+      raise NotImplementedError
+
+   def evaluate(self, cache, out):
+      # Writes the mask into the boolean array `out`, using `cache` for the
+      # masks of conditions.
+      raise NotImplementedError
+
+# end class Filter
+
+
+class Condition(Filter):
+   """
+   OVERVIEW
+
+   A single comparison `field op value`, or a range `field in low..high`
+   (`op` is then 'in' and `value` the pair `(low, high)`).
+   """
+
+   def __init__(self, field, op, value):
+      field= _ALIASES.get(field, field)
+      if field not in FIELDS:
+         raise ValueError("Unknown field %r; expected one of %s." % (field,
+           ', '.join(FIELDS)))
+      if op != 'in' and op not in _OPERATORS:
+         raise ValueError("Unknown operator %r." % op)
+
+      self.field= field
+      self.op= op
+      if op == 'in':
+         self.value= (float(value[0]), float(value[1]))
+         self.key= '%s in %s..%s' % (field, _number(value[0]),
+           _number(value[1]))
+      else:
+         self.value= float(value)
+         self.key= '%s %s %s' % (field, op, _number(value))
+
+   def terms(self):
+      return [self]
+
+   def mask(self, column):
+      """This method returns the mask of the condition over `column`."""
+      if self.op != 'in':
+         result= _OPERATORS[self.op](column, self.value)
+      else:
+         low, high= self.value
+         if low > high and self.field in _PERIODIC:
+            result= (column >= low) | (column <= high)
+         else:
+            result= column >= low
+            result&= column <= high
+
+      # Calm or variable readings (and invalid directions) have no direction,
+      # so they never satisfy a direction condition:
+      if self.field == 'dir':
+         result&= (column >= 0.0) & (column <= 360.0)
+      return result
+
+   def evaluate(self, cache, out):
+      np.copyto(out, cache.condition(self))
+
+# end class Condition
+
+
+class And(Filter):
+
+   def __init__(self, *parts):
+      self.parts= _flatten(And, parts)
+      self.key= '(' + ' & '.join(part.key for part in self.parts) + ')'
+
+   def terms(self):
+      return [term for part in self.parts for term in part.terms()]
+
+   def evaluate(self, cache, out):
+      self.parts[0].evaluate(cache, out)
+      scratch= None
+      for part in self.parts[1:]:
+         if isinstance(part, Condition):
+            out&= cache.condition(part)
+         else:
+            if scratch is None:
+               scratch= np.empty_like(out)
+            part.evaluate(cache, scratch)
+            out&= scratch
+
+# end class And
+
+
+class Or(Filter):
+
+   def __init__(self, *parts):
+      self.parts= _flatten(Or, parts)
+      self.key= '(' + ' | '.join(part.key for part in self.parts) + ')'
+
+   def terms(self):
+      return [term for part in self.parts for term in part.terms()]
+
+   def evaluate(self, cache, out):
+      self.parts[0].evaluate(cache, out)
+      scratch= None
+      for part in self.parts[1:]:
+         if isinstance(part, Condition):
+            out|= cache.condition(part)
+         else:
+            if scratch is None:
+               scratch= np.empty_like(out)
+            part.evaluate(cache, scratch)
+            out|= scratch
+
+# end class Or
+
+
+class Not(Filter):
+
+   def __init__(self, part):
+      self.part= part
+      self.key= '~' + part.key
+
+   def terms(self):
+      return self.part.terms()
+
+   def evaluate(self, cache, out):
+      self.part.evaluate(cache, out)
+      np.logical_not(out, out=out)
+
+# end class Not
+
+
+def _flatten(kind, parts):
+   # Merges nested filters of the same kind, so that a & b & c is a single
+   # `And` with three parts.
+   flat= []
+   for part in parts:
+      if not isinstance(part, Filter):
+         raise TypeError("Filters can only be combined with filters.")
+      flat.extend(part.parts if isinstance(part, kind) else [part])
+   return flat
+
+
+class Field(object):
+   """
+   OVERVIEW
+
+   Builds conditions on one field: `Field('speed') > 0.5`,
+   `Field('hour').between(8, 18)`.
+   """
+
+   def __init__(self, name):
+      self.name= _ALIASES.get(name, name)
+      if self.name not in FIELDS:
+         raise ValueError("Unknown field %r; expected one of %s." % (name,
+           ', '.join(FIELDS)))
+
+   def __lt__(self, value):
+      return Condition(self.name, '<', value)
+
+   def __le__(self, value):
+      return Condition(self.name, '<=', value)
+
+   def __gt__(self, value):
+      return Condition(self.name, '>', value)
+
+   def __ge__(self, value):
+      return Condition(self.name, '>=', value)
+
+   def __eq__(self, value):
+      return Condition(self.name, '==', value)
+
+   def __ne__(self, value):
+      return Condition(self.name, '!=', value)
+
+   __hash__= object.__hash__
+
+   def between(self, low, high):
+      """This method returns the range condition `low <= field <= high`."""
+      return Condition(self.name, 'in', (low, high))
+
+# end class Field
+
+
+_TOKEN= re.compile(r'\s*(?:(?P<number>-?\d+(?:\.\d+)?)|(?P<range>\.\.)|'
+  r'(?P<op><=|>=|==|!=|<|>)|(?P<symbol>[&|~()])|(?P<word>[A-Za-z_]+))')
+
+_WORDS= {'and': '&', 'or': '|', 'not': '~'}
+
+_EXPECTED= {'number': 'a number', 'range': "'..'", 'op': 'a comparison',
+  'word': 'a field name'}
+
+
+def _tokenize(text):
+   tokens= []
+   position= 0
+   text= text.rstrip()
+   while position < len(text):
+      match= _TOKEN.match(text, position)
+      if match is None:
+         raise ValueError("Cannot parse filter at %r." % text[position:])
+      kind= match.lastgroup
+      value= match.group(kind)
+      if kind == 'word' and value.lower() in _WORDS:
+         kind, value= 'symbol', _WORDS[value.lower()]
+      tokens.append((kind, value))
+      position= match.end()
+   return tokens
+
+
+class _Parser(object):
+   # Recursive-descent parser for the grammar
+   #
+   #    filter     := term ('|' term)*
+   #    term       := factor ('&' factor)*
+   #    factor     := '~' factor | '(' filter ')' | condition
+   #    condition  := field op number | field 'in' number '..' number
+
+   def __init__(self, text):
+      self.text= text
+      self.tokens= _tokenize(text)
+      self.position= 0
+
+   def peek(self):
+      if self.position < len(self.tokens):
+         return self.tokens[self.position]
+      return (None, None)
+
+   def take(self, kind, value=None):
+      token= self.peek()
+      if token[0] != kind or (value is not None and token[1] != value):
+         expected= value or _EXPECTED[kind]
+         found= token[1] if token[0] else 'end of filter'
+         raise ValueError("Expected %s but found %s in filter %r."
+           % (expected, found, self.text))
+      self.position+= 1
+      return token[1]
+
+   def parse(self):
+      result= self.filter()
+      if self.peek()[0] is not None:
+         raise ValueError("Unexpected %r in filter %r." % (self.peek()[1],
+           self.text))
+      return result
+
+   def filter(self):
+      parts= [self.term()]
+      while self.peek() == ('symbol', '|'):
+         self.position+= 1
+         parts.append(self.term())
+      return parts[0] if len(parts) == 1 else Or(*parts)
+
+   def term(self):
+      parts= [self.factor()]
+      while self.peek() == ('symbol', '&'):
+         self.position+= 1
+         parts.append(self.factor())
+      return parts[0] if len(parts) == 1 else And(*parts)
+
+   def factor(self):
+      token= self.peek()
+      if token == ('symbol', '~'):
+         self.position+= 1
+         return Not(self.factor())
+      if token == ('symbol', '('):
+         self.position+= 1
+         result= self.filter()
+         self.take('symbol', ')')
+         return result
+
+      field= self.take('word')
+      if self.peek() == ('word', 'in'):
+         self.position+= 1
+         low= self.take('number')
+         self.take('range')
+         high= self.take('number')
+         return Condition(field, 'in', (low, high))
+      op= self.take('op')
+      return Condition(field, op, self.take('number'))
+
+# end class _Parser
+
+
+def parse(text):
+   """
+   OVERVIEW
+
+   This function compiles the filter expression `text` into a `Filter`.
+   Filters that are already `Filter` objects are returned unchanged.
+   """
+
+   if isinstance(text, Filter):
+      return text
+   return _Parser(text).parse()
+
+
+class MaskCache(object):
+   """
+   OVERVIEW
+
+   Evaluates filters against the `WindSeries` `series` and keeps the masks of
+   all conditions and filters evaluated so far.  The columns of `series` must
+   not be modified while the cache is in use (or `clear` must be called).
+   """
+
+   def __init__(self, series):
+      self.series= series
+      self._columns= {}
+      self._masks= {}
+
+   def column(self, field):
+      """This method returns the column of `field`, computing it once."""
+      field= _ALIASES.get(field, field)
+      if field not in self._columns:
+         if field == 'speed':
+            self._columns[field]= self.series.speed
+         elif field == 'dir':
+            self._columns[field]= self.series.direction
+         elif field in FIELDS:
+            self._columns[field]= getattr(self.series, field)
+         else:
+            raise ValueError("Unknown field %r." % field)
+      return self._columns[field]
+
+   def condition(self, condition):
+      # Mask of a single condition, computed once.
+      mask= self._masks.get(condition.key)
+      if mask is None:
+         mask= condition.mask(self.column(condition.field))
+         self._masks[condition.key]= mask
+      return mask
+
+   def mask(self, expression):
+      """
+      OVERVIEW
+
+      This method returns the boolean mask of `expression` (text or a
+      `Filter`).  The returned array is shared with the cache and must not be
+      modified.
+      """
+
+      expression= parse(expression)
+      mask= self._masks.get(expression.key)
+      if mask is None:
+         mask= np.empty(len(self.series), dtype=bool)
+         expression.evaluate(self, mask)
+         self._masks[expression.key]= mask
+      return mask
+
+   def count(self, expression):
+      """This method returns the number of samples selected by `expression`."""
+      return int(np.count_nonzero(self.mask(expression)))
+
+   def select(self, expression):
+      """This method returns the selected samples as a new `WindSeries`."""
+      return self.series.select(self.mask(expression))
+
+   def clear(self):
+      """This method discards all cached masks and derived columns."""
+      self._columns.clear()
+      self._masks.clear()
+
+# end class MaskCache
+
+
+def moment_statistics(cache, expression):
+   """
+   OVERVIEW
+
+   This function returns `weibull.moment_statistics` of the speeds selected
+   by `expression` from the `MaskCache` `cache`, without copying them.
+   """
+
+   return weibull.moment_statistics(cache.column('speed'),
+     where=cache.mask(expression))
+
+
+def fit_subset(cache, expression, method='moments', a=0.1, b=100.0,
+  ftol=1.e-6, xtol=1.e-6, solver=find_root_bisection):
+   """
+   OVERVIEW
+
+   This function returns the Weibull parameters `(k, c)` of the speeds
+   selected by `expression` from the `MaskCache` `cache`.  `method` is
+   'moments' (the fit of `main.py`, computed without copying the selection)
+   or 'ml' (which needs the selected speeds as an array of their own, and
+   ignores calm readings).  The other inputs are as for
+   `weibull.fit_moments`.
+   """
+
+   if method == 'moments':
+      return weibull.fit_moments(*moment_statistics(cache, expression), a=a,
+        b=b, ftol=ftol, xtol=xtol, solver=solver)
+   if method == 'ml':
+      speed= cache.column('speed')[cache.mask(expression)]
+      return weibull.fit_ml(speed[speed > 0.0], a=a, b=b, ftol=ftol,
+        xtol=xtol, solver=solver)
+   raise ValueError("`method` must be 'moments' or 'ml'.")
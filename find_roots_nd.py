@@ -0,0 +1,445 @@
+"""
+find_roots_nd.py
+
+
+OVERVIEW
+
+This module contains functions that find roots of vector-valued functions of
+several variables, i.e. solutions x of F(x)= 0 where x and F(x) are
+n-dimensional.  They complement the 1-D solvers in `find_roots.py` and are
+meant for small systems (a handful of unknowns), such as fitting several
+distribution parameters jointly.
+
+   find_root_newton          damped Newton's method
+   find_root_broyden         Broyden's ("good") quasi-Newton method
+   find_root_newton_batch    damped Newton's method applied to many
+                             independent systems at once
+
+The Jacobian matrix of F may be supplied by the caller or is otherwise
+approximated by forward differences.  Steps are damped by backtracking: a step
+is halved until the norm of F decreases (or F is finite at all), which keeps
+iterates inside the domain of functions that are undefined in places.
+
+Convergence is judged as in `find_roots.py`, with `xtol` applied to the largest
+component of the last step and `ftol` applied to the largest component of
+F(x).  Failures raise `find_roots.AlgorithmFailure`.
+
+
+EXAMPLE
+
+The maximum-likelihood fit of the three-parameter Weibull distribution (shape
+k, scale c, location u) requires solving three score equations.  With only
+1-D solvers, one has to nest them: an outer `find_root` over u, where every
+outer call runs the two-parameter ML fit (a bisection over k) on the shifted
+data.  `weibull.fit_ml3` instead solves the system jointly.
+
+
+Code:
+
+import numpy as np
+import weibull
+from find_roots import find_root
+from find_roots_nd import find_root_newton, find_root_broyden
+
+rng= np.random.default_rng(1)
+x= np.round(1.5 + 6.0 * rng.weibull(2.2, 200000), 1)
+values, weights= np.unique(x, return_counts=True)
+F= weibull.ml3_equations(values, weights)
+p0= weibull.moments3_start(values, weights)
+
+print(find_root_newton(F, p0, ftol=1e-9, xtol=1e-9, verbose=True))
+print(find_root_broyden(F, p0, ftol=1e-9, xtol=1e-9, verbose=True))
+
+def profile(u):
+   k, c= weibull.fit_ml(values - u, weights, ftol=1e-12, xtol=1e-12)
+   return F((k, c, u))[2]
+
+u= find_root(profile, p0[2], 0.5 * (p0[2] + values[0]), ftol=1e-9,
+  xtol=1e-9, verbose=True)
+
+
+Output:
+
+Convergence achieved after 6 steps and 26 calls.
+[2.21415015 6.0157124  1.47764607]
+Convergence achieved after 9 steps and 14 calls.
+[2.21415015 6.0157124  1.47764607]
+...
+Convergence achieved after 16 steps and 18 calls.
+
+
+Discussion:
+
+All three approaches find the same parameters.  The nested solve makes 18
+outer calls, which between them evaluate the inner ML equation 882 times; it
+took 10.4 ms, against 1.8 ms for `find_root_newton` and 1.3 ms for
+`find_root_broyden`.  Broyden's method needs the fewest calls because it
+computes the Jacobian by finite differences only once.
+
+For many stations, `weibull.fit_ml3_batch` applies `find_root_newton_batch` to
+all stations' histograms at once: 50 stations took 33 ms, against 57 ms for a
+loop over `fit_ml3`, with identical results.
+"""
+
+import numpy as np
+
+from find_roots import AlgorithmFailure
+
+
+def jacobian_fd(F, x, Fx=None, rel_step=1.e-7):
+   """
+   OVERVIEW
+
+   This function returns the forward-difference approximation of the Jacobian
+   matrix of `F` at `x`.  `Fx` may be passed to save one evaluation of `F`.
+   """
+
+   x= np.asarray(x, dtype=np.float64)
+   if Fx is None:
+      Fx= np.asarray(F(x), dtype=np.float64)
+
+   J= np.empty((len(Fx), len(x)))
+   for j in range(len(x)):
+      h= rel_step * max(abs(x[j]), 1.0)
+      xh= x.copy()
+      xh[j]+= h
+      J[:, j]= (np.asarray(F(xh), dtype=np.float64) - Fx) / h
+   return J
+
+
+def _converged(dx, Fx, xtol, ftol, both):
+   x_ok= np.max(np.abs(dx)) <= xtol
+   f_ok= np.max(np.abs(Fx)) <= ftol
+   return (x_ok and f_ok) if both else (x_ok or f_ok)
+
+
+def _line_search(F, x, dx, norm0, min_damping):
+   # Backtracking: halve the step until F is finite and its norm decreases.
+   # Returns (new x, F(new x), step taken, number of calls).
+   t= 1.0
+   calls= 0
+   while t >= min_damping:
+      step= t * dx
+      x_new= x + step
+      F_new= np.asarray(F(x_new), dtype=np.float64)
+      calls+= 1
+      if np.all(np.isfinite(F_new)) and (np.linalg.norm(F_new) <=
+        (1.0 - 1.e-4 * t) * norm0):
+         return x_new, F_new, step, calls
+      t*= 0.5
+   return None, None, None, calls
+
+
+def find_root_newton(F, x0, jacobian=None, ftol=1.e-6, xtol=1.e-6, both=True,
+  max_steps=100, min_damping=1.e-6, verbose=False):
+   """
+   OVERVIEW
+
+   This function finds a root of the vector-valued function `F` via Newton's
+   method with backtracking.  Near the root convergence is quadratic.
+
+
+   INPUTS
+
+   `F` is a function that takes a 1-D array `x` of length n and returns a 1-D
+   array of length n.
+
+   `x0` is the starting point.
+
+   `jacobian` is an optional function that takes `x` and returns the n-by-n
+   matrix of partial derivatives dF_i/dx_j.  If omitted, forward differences
+   are used, at the cost of n extra calls of `F` per step.
+
+   `ftol`, `xtol` and `both` are as for `find_roots.find_root_bisection`.
+
+   `max_steps` is the maximum allowed number of iterations.
+
+   `min_damping` is the smallest fraction of a Newton step tried before the
+   line search gives up.
+
+   `verbose`: Setting this input to `True` causes the function to display the
+   numbers of function calls and iterations required for convergence.
+   """
+
+   if xtol <= 0.0:
+      raise ValueError("If specified, `xtol` must be positive.")
+   if ftol <= 0.0:
+      raise ValueError("If specified, `ftol` must be positive.")
+
+   x= np.array(x0, dtype=np.float64)
+   Fx= np.asarray(F(x), dtype=np.float64)
+   calls= 1
+   if not np.all(np.isfinite(Fx)):
+      raise AlgorithmFailure("F is not finite at the starting point.")
+
+   for steps in range(1, max_steps + 1):
+      if jacobian is None:
+         J= jacobian_fd(F, x, Fx)
+         calls+= len(x)
+      else:
+         J= np.asarray(jacobian(x), dtype=np.float64)
+
+      try:
+         dx= np.linalg.solve(J, -Fx)
+      except np.linalg.LinAlgError:
+         raise AlgorithmFailure("At step %d, the Jacobian is singular!" % steps)
+
+      x_new, F_new, step, n= _line_search(F, x, dx, np.linalg.norm(Fx),
+        min_damping)
+      calls+= n
+      if x_new is None:
+         if both and np.max(np.abs(Fx)) <= ftol or not both and (
+           np.max(np.abs(Fx)) <= ftol or np.max(np.abs(dx)) <= xtol):
+            # No further decrease is possible; `x` is as good as it gets.
+            break
+         raise AlgorithmFailure("At step %d, the line search failed to reduce "
+           "|F|." % steps)
+
+      x, Fx= x_new, F_new
+      if _converged(step, Fx, xtol, ftol, both):
+         break
+
+   else:
+      raise AlgorithmFailure("Limit of %d iterations has been reached."
+        % max_steps)
+
+   if verbose:
+      print("Convergence achieved after %d steps and %d calls."
+        % (steps, calls))
+   return x
+
+# end def find_root_newton
+
+
+def find_root_broyden(F, x0, jacobian=None, ftol=1.e-6, xtol=1.e-6,
+  both=True, max_steps=200, min_damping=1.e-6, verbose=False):
+   """
+   OVERVIEW
+
+   This function finds a root of the vector-valued function `F` via Broyden's
+   method.  The Jacobian matrix is computed (or approximated by forward
+   differences) only at the starting point, and is afterwards updated from the
+   observed changes of F, so that each step usually costs a single call of
+   `F`.  Convergence is superlinear rather than quadratic.  When a step fails
+   to reduce |F|, the Jacobian is recomputed at the current point.
+
+   The inputs are as for `find_root_newton`.
+   """
+
+   if xtol <= 0.0:
+      raise ValueError("If specified, `xtol` must be positive.")
+   if ftol <= 0.0:
+      raise ValueError("If specified, `ftol` must be positive.")
+
+   def full_jacobian(x, Fx):
+      if jacobian is None:
+         return jacobian_fd(F, x, Fx), len(x)
+      return np.asarray(jacobian(x), dtype=np.float64), 0
+
+   x= np.array(x0, dtype=np.float64)
+   Fx= np.asarray(F(x), dtype=np.float64)
+   calls= 1
+   if not np.all(np.isfinite(Fx)):
+      raise AlgorithmFailure("F is not finite at the starting point.")
+
+   B, n= full_jacobian(x, Fx)
+   calls+= n
+   fresh= True
+
+   for steps in range(1, max_steps + 1):
+      try:
+         dx= np.linalg.solve(B, -Fx)
+      except np.linalg.LinAlgError:
+         dx= None
+
+      x_new= None
+      if dx is not None:
+         x_new, F_new, step, n= _line_search(F, x, dx, np.linalg.norm(Fx),
+           min_damping)
+         calls+= n
+
+      if x_new is None:
+         if not fresh:
+            # The secant approximation has gone stale; start afresh.
+            B, n= full_jacobian(x, Fx)
+            calls+= n
+            fresh= True
+            continue
+         if dx is not None and (both and np.max(np.abs(Fx)) <= ftol or
+           not both and (np.max(np.abs(Fx)) <= ftol or
+           np.max(np.abs(dx)) <= xtol)):
+            break
+         raise AlgorithmFailure("At step %d, no step reduces |F|." % steps)
+
+      # Broyden's rank-one update:
+      dF= F_new - Fx
+      B+= np.outer(dF - B.dot(step), step) / step.dot(step)
+      fresh= False
+
+      x, Fx= x_new, F_new
+      if _converged(step, Fx, xtol, ftol, both):
+         break
+
+   else:
+      raise AlgorithmFailure("Limit of %d iterations has been reached."
+        % max_steps)
+
+   if verbose:
+      print("Convergence achieved after %d steps and %d calls."
+        % (steps, calls))
+   return x
+
+# end def find_root_broyden
+
+
+def _solve_rows(A, b):
+   # Solves A[i] x[i]= b[i] for every i; rows whose matrix is not finite or
+   # is singular get NaN solutions.
+   x= np.full(b.shape, np.nan)
+   finite= np.all(np.isfinite(A), axis=(1, 2)) & np.all(np.isfinite(b),
+     axis=1)
+   try:
+      x[finite]= np.linalg.solve(A[finite], b[finite, :, None])[:, :, 0]
+   except np.linalg.LinAlgError:
+      # One singular matrix fails the whole stacked solve; retry one by one.
+      for i in np.flatnonzero(finite):
+         try:
+            x[i]= np.linalg.solve(A[i], b[i])
+         except np.linalg.LinAlgError:
+            pass
+   return x
+
+
+def find_root_newton_batch(F, X0, jacobian=None, ftol=1.e-6, xtol=1.e-6,
+  both=True, max_steps=100, min_damping=1.e-6, rel_step=1.e-7,
+  full_output=False, verbose=False):
+   """
+   OVERVIEW
+
+   This function solves m independent n-dimensional systems F(x)= 0 with
+   damped Newton steps, evaluating all systems that are still iterating in
+   one call of `F`.  This pays off when F is a vectorized NumPy expression,
+   because the cost of a call then hardly depends on the number of systems.
+
+
+   INPUTS
+
+   `F` is a function that takes an m'-by-n array of points and an array of
+   m' row indices into the batch (which rows of the batch the points belong
+   to), and returns an m'-by-n array of function values.  The indices allow
+   `F` to pick per-system data; m' shrinks as systems converge.
+
+   `X0` is the m-by-n array of starting points.
+
+   `jacobian` is an optional function with the same arguments as `F` that
+   returns an m'-by-n-by-n array.  If omitted, forward differences are used,
+   at the cost of n extra calls of `F` per step.
+
+   `full_output`: if `True`, the function returns `(X, converged, steps,
+   calls)`, where `converged` is a boolean array and `steps` an integer array
+   with one entry per system, and `calls` the number of calls of `F`; systems
+   that fail keep their last iterate.  Otherwise it returns `X` and raises
+   `AlgorithmFailure` if any system fails.
+
+   The other inputs are as for `find_root_newton`.
+   """
+
+   if xtol <= 0.0:
+      raise ValueError("If specified, `xtol` must be positive.")
+   if ftol <= 0.0:
+      raise ValueError("If specified, `ftol` must be positive.")
+
+   X= np.array(X0, dtype=np.float64)
+   if X.ndim != 2:
+      raise ValueError("`X0` must be a two-dimensional array.")
+   m, n= X.shape
+
+   rows= np.arange(m)
+   FX= np.asarray(F(X, rows), dtype=np.float64)
+   calls= 1
+
+   converged= np.zeros(m, bool)
+   failed= ~np.all(np.isfinite(FX), axis=1)
+   steps= np.zeros(m, np.int64)
+
+   for step_number in range(1, max_steps + 1):
+      active= np.flatnonzero(~converged & ~failed)
+      if len(active) == 0:
+         break
+      steps[active]= step_number
+
+      x= X[active]
+      fx= FX[active]
+      if jacobian is None:
+         J= np.empty((len(active), n, n))
+         h= rel_step * np.maximum(np.abs(x), 1.0)
+         for j in range(n):
+            xh= x.copy()
+            xh[:, j]+= h[:, j]
+            J[:, :, j]= (np.asarray(F(xh, active), dtype=np.float64) - fx) / (
+              h[:, j, None])
+         calls+= n
+      else:
+         J= np.asarray(jacobian(x, active), dtype=np.float64)
+
+      # Systems with a singular or non-finite Jacobian (e.g. a difference
+      # probe outside the domain of F) are marked as failed rather than
+      # aborting the batch:
+      dx= _solve_rows(J, -fx)
+      singular= ~np.all(np.isfinite(dx), axis=1)
+      if np.any(singular):
+         failed[active[singular]]= True
+         keep= ~singular
+         active, x, fx, dx= active[keep], x[keep], fx[keep], dx[keep]
+         if len(active) == 0:
+            continue
+
+      # Backtracking for all systems at once; only systems whose step was
+      # rejected are evaluated again.
+      norm0= np.linalg.norm(fx, axis=1)
+      t= np.ones(len(active))
+      pending= np.arange(len(active))
+      x_new= x.copy()
+      f_new= fx.copy()
+      while len(pending):
+         trial= x[pending] + t[pending, None] * dx[pending]
+         f_trial= np.asarray(F(trial, active[pending]), dtype=np.float64)
+         calls+= 1
+         ok= np.all(np.isfinite(f_trial), axis=1) & (np.linalg.norm(f_trial,
+           axis=1) <= (1.0 - 1.e-4 * t[pending]) * norm0[pending])
+         x_new[pending[ok]]= trial[ok]
+         f_new[pending[ok]]= f_trial[ok]
+         pending= pending[~ok]
+         t[pending]*= 0.5
+         stuck= pending[t[pending] < min_damping]
+         if len(stuck):
+            f_ok= np.max(np.abs(fx[stuck]), axis=1) <= ftol
+            if not both:
+               f_ok|= np.max(np.abs(dx[stuck]), axis=1) <= xtol
+            converged[active[stuck[f_ok]]]= True
+            failed[active[stuck[~f_ok]]]= True
+            pending= pending[t[pending] >= min_damping]
+
+      moved= ~(converged[active] | failed[active])
+      step= (t[:, None] * dx)[moved]
+      X[active[moved]]= x_new[moved]
+      FX[active[moved]]= f_new[moved]
+
+      x_ok= np.max(np.abs(step), axis=1) <= xtol
+      f_ok= np.max(np.abs(f_new[moved]), axis=1) <= ftol
+      converged[active[moved]]= (x_ok & f_ok) if both else (x_ok | f_ok)
+
+   failed|= ~converged
+
+   if verbose:
+      print("%d of %d systems converged after at most %d steps and %d calls."
+        % (np.count_nonzero(converged), m, steps.max() if m else 0, calls))
+
+   if full_output:
+      return X, converged, steps, calls
+   if np.any(failed):
+      raise AlgorithmFailure("%d of %d systems failed to converge."
+        % (np.count_nonzero(failed), m))
+   return X
+
+# end def find_root_newton_batch
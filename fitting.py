@@ -0,0 +1,372 @@
+"""
+fitting.py
+
+
+OVERVIEW
+
+This module fits several candidate distributions to a sample of wind speeds and
+ranks them by goodness of fit.  The candidates are
+
+   'weibull'        two-parameter Weibull (k, c)
+   'weibull_calm'   point mass p0 at zero plus a Weibull (p0, k, c)
+   'rayleigh'       Rayleigh (sigma)
+   'lognormal'      lognormal (mu, sigma of ln x)
+   'gamma'          gamma (shape a, scale theta)
+
+All fits are maximum-likelihood fits.  Apart from 'weibull_calm', whose point
+mass absorbs them, zero readings are excluded from the fits because the
+continuous densities cannot represent them.  For the same reason, the KS and
+AD statistics of a candidate are computed against the sample it was fitted
+to: the positive speeds, or all speeds for 'weibull_calm'.  (Against a sample
+with calms, a continuous CDF is 0 at the calm readings, and the AD statistic
+would be infinite.)  The log-likelihood, and so the AIC, always covers the
+whole sample.
+
+The sample is sorted once and reduced to its distinct values and their counts.
+Recorded speeds are quantized, so a long record has only a few hundred
+distinct values.  Every fit then works from shared sums over this reduced
+sample, and every score is computed with one vectorized CDF evaluation per
+candidate:
+
+   ks       Kolmogorov-Smirnov statistic
+   ad       Anderson-Darling statistic
+   loglik   log-likelihood of the data as recorded, i.e. with every reading
+            standing for the interval of width `resolution` around it, so that
+            calm readings and the point mass are scored consistently
+   aic      2 * (number of parameters) - 2 * loglik
+"""
+
+import collections
+import math
+
+import numpy as np
+
+import weibull
+from find_roots import AlgorithmFailure, find_root
+
+FitResult= collections.namedtuple('FitResult',
+  ['name', 'params', 'ks', 'ad', 'loglik', 'aic'])
+
+# Smallest probability used inside logarithms:
+_TINY= 1.e-300
+
+
+# Special functions.  These are evaluated on arrays of distinct sample values,
+# so they are written with NumPy rather than `math`.
+
+def _erfc(x):
+   # Chebyshev fit (Numerical Recipes `erfcc`); fractional error < 1.2e-7.
+   z= np.abs(x)
+   t= 1.0 / (1.0 + 0.5 * z)
+   r= t * np.exp(-z*z - 1.26551223 + t*(1.00002368 + t*(0.37409196 +
+     t*(0.09678418 + t*(-0.18628806 + t*(0.27886807 + t*(-1.13520398 +
+     t*(1.48851587 + t*(-0.82215223 + t*0.17087277)))))))))
+   return np.where(x >= 0.0, r, 2.0 - r)
+
+
+def _gammainc(a, x, eps=1.e-14, max_terms=1000):
+   # Regularized lower incomplete gamma function P(a, x), for scalar a > 0.
+   x= np.asarray(x, dtype=np.float64)
+   p= np.zeros_like(x)
+   lg= math.lgamma(a)
+
+   # Series for x < a + 1:
+   low= (x > 0.0) & (x < a + 1.0)
+   if np.any(low):
+      xl= x[low]
+      term= 1.0 / a * np.ones_like(xl)
+      total= term.copy()
+      for n in range(1, max_terms):
+         term*= xl / (a + n)
+         total+= term
+         if np.all(term < total * eps):
+            break
+      p[low]= total * np.exp(-xl + a * np.log(xl) - lg)
+
+   # Continued fraction (modified Lentz) for Q(a, x), x >= a + 1:
+   high= x >= a + 1.0
+   if np.any(high):
+      xh= x[high]
+      b= xh + 1.0 - a
+      c= np.full_like(xh, 1.0 / _TINY)
+      d= 1.0 / b
+      h= d.copy()
+      for n in range(1, max_terms):
+         an= -n * (n - a)
+         b+= 2.0
+         d= an * d + b
+         d[np.abs(d) < _TINY]= _TINY
+         c= b + an / c
+         c[np.abs(c) < _TINY]= _TINY
+         d= 1.0 / d
+         delta= d * c
+         h*= delta
+         if np.all(np.abs(delta - 1.0) < eps):
+            break
+      p[high]= 1.0 - np.exp(-xh + a * np.log(xh) - lg) * h
+
+   return p
+
+
+def _digamma(x):
+   # Digamma function for scalar x > 0 (recurrence plus asymptotic series).
+   result= 0.0
+   while x < 6.0:
+      result-= 1.0 / x
+      x+= 1.0
+   f= 1.0 / (x * x)
+   return result + math.log(x) - 0.5 / x - f * (1.0/12 - f * (1.0/120 -
+     f * (1.0/252 - f * (1.0/240 - f / 132))))
+
+
+class SampleSummary(object):
+   """
+   OVERVIEW
+
+   Distinct values, counts and shared sums of one wind-speed sample, computed
+   from a single sort.  All fits and scores in this module take a
+   `SampleSummary`.
+
+   INPUTS
+
+   `speeds` is an array of wind speeds.
+
+   `presorted` may be set to `True` when `speeds` is already sorted.
+   """
+
+   def __init__(self, speeds, presorted=False):
+      speeds= np.asarray(speeds, dtype=np.float64)
+      if not presorted:
+         speeds= np.sort(speeds)
+      if len(speeds) == 0:
+         raise ValueError("Cannot fit an empty sample.")
+      if speeds[0] < 0.0:
+         raise ValueError("Wind speeds must be non-negative.")
+
+      # Distinct values of a sorted array, without a second sort:
+      starts= np.flatnonzero(np.r_[True, speeds[1:] != speeds[:-1]])
+      self._summarize(speeds[starts], np.diff(np.r_[starts, len(speeds)]))
+
+   def _summarize(self, values, counts):
+      self.values= values
+      self.counts= counts
+      self.cum= np.cumsum(self.counts)
+      self.n= int(self.cum[-1])
+
+      positive= self.values > 0.0
+      self.pos_values= self.values[positive]
+      self.pos_counts= self.counts[positive]
+      self.n_pos= int(self.pos_counts.sum())
+      self.n_zero= self.n - self.n_pos
+      if self.n_pos == 0:
+         raise ValueError("Cannot fit a sample with no positive speeds.")
+
+      w= self.pos_counts
+      log_values= np.log(self.pos_values)
+      self.mean= np.dot(w, self.pos_values) / self.n_pos
+      self.mean_square= np.dot(w, self.pos_values ** 2) / self.n_pos
+      self.mean_log= np.dot(w, log_values) / self.n_pos
+      self.var_log= np.dot(w, (log_values - self.mean_log) ** 2) / self.n_pos
+
+   def positive_part(self):
+      """
+      OVERVIEW
+
+      This method returns the `SampleSummary` of the positive speeds only
+      (this summary itself if there are no zero speeds).
+      """
+
+      if self.n_zero == 0:
+         return self
+      positive= SampleSummary.__new__(SampleSummary)
+      positive._summarize(self.pos_values, self.pos_counts)
+      return positive
+
+# end class SampleSummary
+
+
+# Fits.  Each takes a `SampleSummary` and returns a parameter tuple.
+
+def _fit_weibull(s):
+   return weibull.fit_ml(s.pos_values, s.pos_counts)
+
+
+def _fit_weibull_calm(s):
+   k, c= _fit_weibull(s)
+   return s.n_zero / s.n, k, c
+
+
+def _fit_rayleigh(s):
+   return (math.sqrt(s.mean_square / 2.0),)
+
+
+def _fit_lognormal(s):
+   return s.mean_log, math.sqrt(s.var_log)
+
+
+def _fit_gamma(s):
+   # ML shape equation: ln(a) - digamma(a) = ln(mean) - mean(ln x).
+   target= math.log(s.mean) - s.mean_log
+   if target <= 0.0:
+      raise ValueError("The gamma fit needs at least two distinct positive "
+        "speeds.")
+   a0= (3.0 - target + math.sqrt((target - 3.0) ** 2 + 24.0 * target)) / (
+     12.0 * target)
+   a= find_root(lambda a: math.log(a) - _digamma(a) - target, 0.5 * a0,
+     2.0 * a0, ftol=1.e-12, xtol=1.e-10 * a0)
+   return a, s.mean / a
+
+
+# CDFs.  Each takes an array `x` and the parameter tuple.
+
+def _cdf_weibull(x, k, c):
+   return -np.expm1(-(np.maximum(x, 0.0) / c) ** k)
+
+
+def _cdf_weibull_calm(x, p0, k, c):
+   return np.where(x >= 0.0, p0 + (1.0 - p0) * _cdf_weibull(x, k, c), 0.0)
+
+
+def _cdf_rayleigh(x, sigma):
+   return _cdf_weibull(x, 2.0, math.sqrt(2.0) * sigma)
+
+
+def _cdf_lognormal(x, mu, sigma):
+   with np.errstate(divide='ignore'):
+      z= (np.log(np.maximum(x, 0.0)) - mu) / (sigma * math.sqrt(2.0))
+   return 0.5 * _erfc(-z)
+
+
+def _cdf_gamma(x, a, theta):
+   return _gammainc(a, np.maximum(x, 0.0) / theta)
+
+
+# name -> (fit, cdf, number of parameters)
+DISTRIBUTIONS= collections.OrderedDict([
+   ('weibull', (_fit_weibull, _cdf_weibull, 2)),
+   ('weibull_calm', (_fit_weibull_calm, _cdf_weibull_calm, 3)),
+   ('rayleigh', (_fit_rayleigh, _cdf_rayleigh, 1)),
+   ('lognormal', (_fit_lognormal, _cdf_lognormal, 2)),
+   ('gamma', (_fit_gamma, _cdf_gamma, 2)),
+])
+
+# Candidates fitted to all speeds, calms included; the others are fitted to
+# the positive speeds:
+WITH_CALMS= frozenset(['weibull_calm'])
+
+
+def score(s, cdf, params, resolution=0.1, positive_only=False):
+   """
+   OVERVIEW
+
+   This function returns the `(ks, ad, loglik)` scores of the distribution
+   with CDF `cdf(x, *params)` against the `SampleSummary` `s`.  If
+   `positive_only` is set, KS and AD are computed against the positive speeds
+   of `s` only; the log-likelihood always covers all of `s`.
+
+   The AD statistic is infinite if the CDF is 0 or 1 at some speed, which
+   happens when a continuous CDF is scored against calm readings.
+   """
+
+   t= s.positive_part() if positive_only else s
+   n= t.n
+   F= np.clip(cdf(t.values, *params), 0.0, 1.0)
+   upper= t.cum / n
+   lower= (t.cum - t.counts) / n
+   ks= max(np.max(upper - F), np.max(F - lower))
+
+   # Anderson-Darling with tied samples grouped: samples with (1-based) ranks
+   # before+1 .. before+m share one CDF value.
+   before= (t.cum - t.counts).astype(np.float64)
+   after= (n - t.cum).astype(np.float64)
+   w_lower= (before + t.counts) ** 2 - before ** 2
+   w_upper= (after + t.counts) ** 2 - after ** 2
+   if np.any(F <= 0.0) or np.any(F >= 1.0):
+      ad= np.inf
+   else:
+      ad= -n - (np.dot(w_lower, np.log(F)) + np.dot(w_upper, np.log1p(-F))) / n
+
+   half= 0.5 * resolution
+   prob= cdf(s.values + half, *params) - cdf(s.values - half, *params)
+   loglik= np.dot(s.counts, np.log(np.maximum(prob, _TINY)))
+
+   return float(ks), float(ad), float(loglik)
+
+
+def fit_all(speeds, distributions=None, by='aic', resolution=0.1,
+  presorted=False):
+   """
+   OVERVIEW
+
+   This function fits every candidate distribution to `speeds` and returns a
+   list of `FitResult` tuples, best first.
+
+   INPUTS
+
+   `speeds` is an array of wind speeds or a `SampleSummary`.
+
+   `distributions` is an optional list of names from `DISTRIBUTIONS`; the
+   default is all of them.
+
+   `by` is the ranking criterion: 'aic', 'loglik', 'ks' or 'ad'.  Log-
+   likelihood ranks from high to low, the others from low to high.
+
+   `resolution` is the recording resolution of the speeds, used by the
+   log-likelihood.
+
+   `presorted` may be set to `True` when `speeds` is already sorted.
+
+   A candidate whose fit fails (for example, a solver that does not converge)
+   is omitted from the table.
+   """
+
+   if by not in FitResult._fields[2:]:
+      raise ValueError("`by` must be one of 'ks', 'ad', 'loglik' or 'aic'.")
+
+   s= speeds if isinstance(speeds, SampleSummary) else SampleSummary(speeds,
+     presorted)
+
+   table= []
+   for name in distributions or DISTRIBUTIONS:
+      fit, cdf, n_params= DISTRIBUTIONS[name]
+      try:
+         params= fit(s)
+      except (ValueError, ArithmeticError, AlgorithmFailure):
+         continue
+
+      ks, ad, loglik= score(s, cdf, params, resolution,
+        positive_only=name not in WITH_CALMS)
+      table.append(FitResult(name, params, ks, ad, loglik,
+        2.0 * n_params - 2.0 * loglik))
+
+   sign= -1.0 if by == 'loglik' else 1.0
+   table.sort(key=lambda row: sign * getattr(row, by))
+   return table
+
+
+def fit_batch(stations, distributions=None, by='aic', resolution=0.1):
+   """
+   OVERVIEW
+
+   This function applies `fit_all` to every speed array in `stations` (a
+   sequence, or a mapping from station name to speeds) and returns the ranked
+   tables in the same order (or as a mapping with the same keys).
+   """
+
+   if isinstance(stations, dict):
+      return collections.OrderedDict((key, fit_all(value, distributions, by,
+        resolution)) for key, value in stations.items())
+
+   return [fit_all(value, distributions, by, resolution) for value in stations]
+
+
+def format_table(table):
+   """This function renders a ranked table as text."""
+
+   lines= ['%-13s %10s %10s %14s %14s  %s'
+     % ('distribution', 'KS', 'AD', 'loglik', 'AIC', 'parameters')]
+   for row in table:
+      lines.append('%-13s %10.5f %10.3f %14.2f %14.2f  %s'
+        % (row.name, row.ks, row.ad, row.loglik, row.aic,
+        ', '.join('%.6g' % p for p in row.params)))
+   return '\n'.join(lines)
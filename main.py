@@ -1,37 +1,68 @@
 import numpy as np
+import io
 import math
+import os
 from find_roots import *
+from profiling import Profiler
+from result_cache import ResultCache
+from wind_data import open_station
+
+#opt-in stage profiling, see profiling.py
+profile = os.environ.get('WIND_PROFILE', '')
+profiler = Profiler(enabled=bool(profile), trace_memory=bool(os.environ.get('WIND_PROFILE_MEMORY')))
+
+#fits of unchanged data files are served from the result cache (except
+#when profiling, which needs the stages to run)
+cache = ResultCache()
+settings = dict(method='moments', solver='bisection', a=0.1, b=100.0, xtol=1e-6, ftol=1e-6)
+result = None if profile else cache.get('input.txt', **settings)
+if result is not None:
+        print("\nCached `find_root_bisection` result (%d calls)." % result['calls'])
+        print('%3f' % result['k'])
+        print(result['c'])
+        raise SystemExit
 
 data = []
 tmp = 0
 
-#read data file
-with open('input.txt', 'rt') as inputfile:
-        for inputline in inputfile:
+#read data file (which may be gzip, bz2 or xz compressed)
+with profiler.stage('read'):
+        with io.TextIOWrapper(open_station('input.txt')) as inputfile:
+                lines = inputfile.readlines()
+
+with profiler.stage('parse'):
+        for inputline in lines:
                 if tmp == 0:
                         tmp = 1
                 else:
                         linedata = inputline.split()
                         data.append(float(linedata[2]))
 
-#calculate average
-mean = np.average(data, axis=0)
-#calculate average of the cubed data
-meanCube = np.average(np.power(data, 3), axis=0)
+with profiler.stage('moments'):
+        #calculate average
+        mean = np.average(data, axis=0)
+        #calculate average of the cubed data
+        meanCube = np.average(np.power(data, 3), axis=0)
 
 #calculate the cumulative
-cumulative = 0
-for element in data:
-        if element < mean:
-                cumulative = cumulative + 1
+with profiler.stage('below-mean'):
+        cumulative = 0
+        for element in data:
+                if element < mean:
+                        cumulative = cumulative + 1
 
-cumulative = cumulative / len(data)
+        cumulative = cumulative / len(data)
+
+calls = 0
 
 def f(x):
+   global calls
+   calls = calls + 1
    return cumulative + math.exp(-(mean / ((meanCube / math.gamma(1 + 3 / x)) ** (1 / 3))) ** x) - 1
 
 print("\nTesting `find_root_bisection` ...")
-x= find_root_bisection(f, 0.1, 100.0, xtol=1e-6, ftol=1e-6, verbose=True)
+with profiler.stage('solve'):
+        x= find_root_bisection(f, 0.1, 100.0, xtol=1e-6, ftol=1e-6, verbose=True)
 print('%3f' % x)
 #
 # print("\nTesting `find_root_secant` ...")
@@ -46,4 +77,15 @@ print('%3f' % x)
 # x= find_root(f, 0.6, 6.0, xtol=1e-6, ftol=1e-6, contraction_factor=1.0, verbose=True)
 # print('%6f' % x)
 
-print(mean / math.gamma(1 + 1 / x))
\ No newline at end of file
+with profiler.stage('scale'):
+        c = mean / math.gamma(1 + 1 / x)
+print(c)
+
+cache.put('input.txt', {'k': x, 'c': float(c), 'calls': calls}, **settings)
+
+if profile:
+        print('\n' + profiler.report())
+        if profile.endswith('.json'):
+                with open(profile, 'wt') as outputfile:
+                        outputfile.write(profiler.to_json(indent=1))
+profiler.close()
\ No newline at end of file
@@ -0,0 +1,268 @@
+"""
+mcp.py
+
+
+OVERVIEW
+
+This module implements measure-correlate-predict (MCP): a short record at the
+site of interest (the target, such as `input.txt`) is related to concurrent
+data of long-term reference stations, and the relationship is applied to the
+full reference records to obtain a long-term synthetic series for the site.
+
+   match_times        pair target and reference samples by timestamp
+   fit_relation       fit per-sector relationships between concurrent speeds
+   SectorRelation     a fitted relationship; `predict` applies it
+   predict_long_term  MCP against one reference station
+   mcp                MCP against many reference stations, combined
+
+Timestamps are matched with a sorted merge on int64 epoch seconds
+(`numpy.searchsorted`), pairing every target sample with the nearest
+reference sample within `tolerance` seconds.  This absorbs the drift between
+records stamped on the hour and at :53 past the hour, as in `input.txt`.
+
+Relationships are fitted per direction sector of the reference station, using
+`numpy.bincount` to form the sums of all sectors at once.  Two methods are
+available:
+
+   'linear'           least squares: y= intercept + slope * x
+   'variance-ratio'   slope= std(y) / std(x), intercept= mean(y) - slope *
+                      mean(x), which preserves the variance of the target
+
+Calm or variable readings of the reference (direction 999) and sectors with
+fewer than `min_points` concurrent samples use the relationship fitted to all
+concurrent data.  The long-term series is a `WindSeries`, so it feeds the
+Weibull fits directly, e.g. `weibull.fit_moments(*weibull.moment_statistics(
+series.speed))`.
+"""
+
+import numpy as np
+
+from wind_data import CALM_DIRECTION, WindSeries
+
+METHODS= ('linear', 'variance-ratio')
+
+
+def _sorted(series):
+   # Returns `series` sorted by time (without copying if it already is).
+   if len(series) < 2 or np.all(series.time[1:] >= series.time[:-1]):
+      return series
+   return series.select(np.argsort(series.time, kind='stable'))
+
+
+def match_times(target_time, reference_time, tolerance=900):
+   """
+   OVERVIEW
+
+   This function pairs every element of the sorted int64 array `target_time`
+   with the nearest element of the sorted array `reference_time`, and returns
+   the index arrays `(target_index, reference_index)` of the pairs whose times
+   differ by at most `tolerance` seconds.
+   """
+
+   target_time= np.asarray(target_time, dtype=np.int64)
+   reference_time= np.asarray(reference_time, dtype=np.int64)
+   if len(target_time) == 0 or len(reference_time) == 0:
+      empty= np.empty(0, np.int64)
+      return empty, empty
+
+   right= np.clip(np.searchsorted(reference_time, target_time), 1,
+     len(reference_time) - 1)
+   left= right - 1
+   if len(reference_time) == 1:
+      right= left= np.zeros_like(right)
+
+   nearer_left= (target_time - reference_time[left]) <= (
+     reference_time[right] - target_time)
+   nearest= np.where(nearer_left, left, right)
+   close= np.abs(reference_time[nearest] - target_time) <= tolerance
+   return np.flatnonzero(close), nearest[close]
+
+
+def sector_index(direction, sectors=12):
+   """
+   OVERVIEW
+
+   This function returns the sector number (0 to `sectors` - 1, the first
+   centred on north) of every direction, and `sectors` for calm or variable
+   readings.
+   """
+
+   direction= np.asarray(direction, dtype=np.float64)
+   width= 360.0 / sectors
+   index= (np.floor((direction + 0.5 * width) / width) % sectors).astype(
+     np.int64)
+   invalid= (direction == CALM_DIRECTION) | ~np.isfinite(direction) | (
+     direction < 0.0) | (direction > 360.0)
+   index[invalid]= sectors
+   return index
+
+
+class SectorRelation(object):
+   """
+   OVERVIEW
+
+   Per-sector linear relationships y= intercept + slope * x between reference
+   speeds x and target speeds y.  Arrays have one entry per sector plus a
+   last entry for calm or variable readings; `overall` holds the (intercept,
+   slope) pair fitted to all data.  `count` and `correlation` are the number
+   of concurrent samples and the correlation coefficient per sector.
+   """
+
+   def __init__(self, sectors, method, intercept, slope, count, correlation,
+     overall, overall_correlation):
+      self.sectors= sectors
+      self.method= method
+      self.intercept= intercept
+      self.slope= slope
+      self.count= count
+      self.correlation= correlation
+      self.overall= overall
+      self.overall_correlation= overall_correlation
+
+   def predict(self, speed, direction):
+      """
+      OVERVIEW
+
+      This method returns the predicted target speeds for reference speeds
+      `speed` and directions `direction`.  Negative predictions are set to 0.
+      """
+
+      index= sector_index(direction, self.sectors)
+      prediction= self.intercept[index] + self.slope[index] * np.asarray(speed)
+      return np.maximum(prediction, 0.0)
+
+# end class SectorRelation
+
+
+def _coefficients(n, sx, sy, sxx, syy, sxy, method):
+   # Vectorized intercepts, slopes and correlations from per-group sums.
+   with np.errstate(divide='ignore', invalid='ignore'):
+      mean_x= sx / n
+      mean_y= sy / n
+      var_x= sxx / n - mean_x ** 2
+      var_y= syy / n - mean_y ** 2
+      cov= sxy / n - mean_x * mean_y
+      correlation= cov / np.sqrt(var_x * var_y)
+      if method == 'linear':
+         slope= cov / var_x
+      else:
+         slope= np.sqrt(var_y / var_x)
+      intercept= mean_y - slope * mean_x
+   return intercept, slope, correlation
+
+
+def fit_relation(x, direction, y, sectors=12, method='linear', min_points=10):
+   """
+   OVERVIEW
+
+   This function fits a `SectorRelation` between the concurrent reference
+   speeds `x` (with reference directions `direction`) and target speeds `y`.
+
+   INPUTS
+
+   `sectors` is the number of equal direction sectors.
+
+   `method` is one of `METHODS`.
+
+   `min_points` is the smallest number of concurrent samples with which a
+   sector gets its own relationship.
+   """
+
+   if method not in METHODS:
+      raise ValueError("`method` must be one of %s." % ', '.join(METHODS))
+
+   x= np.asarray(x, dtype=np.float64)
+   y= np.asarray(y, dtype=np.float64)
+   if len(x) < 2:
+      raise ValueError("At least two concurrent samples are needed.")
+
+   index= sector_index(direction, sectors)
+   bins= sectors + 1
+   sums= [np.bincount(index, weights, minlength=bins) for weights in
+     (None, x, y, x * x, y * y, x * y)]
+   intercept, slope, correlation= _coefficients(*(sums + [method]))
+
+   totals= [s.sum() for s in sums]
+   overall_intercept, overall_slope, overall_correlation= _coefficients(
+     *(totals + [method]))
+   if not (np.isfinite(overall_slope) and np.isfinite(overall_intercept)):
+      raise ValueError("The reference speeds do not vary.")
+
+   count= sums[0].astype(np.int64)
+   fallback= (count < min_points) | ~np.isfinite(slope) | ~np.isfinite(
+     intercept)
+   fallback[sectors]= True
+   intercept[fallback]= overall_intercept
+   slope[fallback]= overall_slope
+
+   return SectorRelation(sectors, method, intercept, slope, count, correlation,
+     (float(overall_intercept), float(overall_slope)),
+     float(overall_correlation))
+
+
+def predict_long_term(target, reference, sectors=12, method='linear',
+  tolerance=900, min_points=10):
+   """
+   OVERVIEW
+
+   This function performs MCP of the `WindSeries` `target` against the
+   `WindSeries` `reference` and returns `(series, relation)`: the long-term
+   synthetic target series (timestamps and directions of the reference,
+   predicted speeds) and the fitted `SectorRelation`.  The other inputs are
+   as for `match_times` and `fit_relation`.
+   """
+
+   target= _sorted(target)
+   reference= _sorted(reference)
+   ti, ri= match_times(target.time, reference.time, tolerance)
+   relation= fit_relation(reference.speed[ri], reference.direction[ri],
+     target.speed[ti], sectors, method, min_points)
+
+   speed= relation.predict(reference.speed, reference.direction)
+   return WindSeries(reference.time, speed, reference.direction), relation
+
+
+def mcp(target, references, sectors=12, method='linear', tolerance=900,
+  min_points=10, step=3600):
+   """
+   OVERVIEW
+
+   This function performs MCP of the `WindSeries` `target` against every
+   `WindSeries` in `references` and combines the predictions into a single
+   long-term series.  It returns `(series, relations)`, where `relations` is
+   the list of fitted `SectorRelation`s.
+
+   Predictions are placed on a common grid of `step` seconds (timestamps are
+   rounded to the nearest multiple of `step`).  Where several references
+   cover a grid time, their predictions are averaged with weights equal to the
+   squared overall correlation of each reference with the target.  The
+   direction is taken from the first reference, in the order given, that
+   covers the grid time.  The other inputs are as for `predict_long_term`.
+   """
+
+   times, speeds, directions, weights, relations= [], [], [], [], []
+   for reference in references:
+      series, relation= predict_long_term(target, reference, sectors, method,
+        tolerance, min_points)
+      relations.append(relation)
+      times.append((series.time + step // 2) // step * step)
+      speeds.append(series.speed)
+      directions.append(series.direction)
+      weights.append(np.full(len(series), relation.overall_correlation ** 2))
+
+   if not relations:
+      raise ValueError("At least one reference station is needed.")
+
+   time= np.concatenate(times)
+   speed= np.concatenate(speeds)
+   direction= np.concatenate(directions)
+   weight= np.concatenate(weights)
+
+   grid, first, group= np.unique(time, return_index=True, return_inverse=True)
+   total= np.bincount(group, weight, minlength=len(grid))
+   combined= np.bincount(group, weight * speed, minlength=len(grid))
+   with np.errstate(invalid='ignore', divide='ignore'):
+      combined= np.where(total > 0.0, combined / total, np.bincount(group,
+        speed, minlength=len(grid)) / np.bincount(group, minlength=len(grid)))
+
+   return WindSeries(grid, combined, direction[first]), relations
@@ -0,0 +1,218 @@
+"""
+persistence.py
+
+
+OVERVIEW
+
+This module describes how wind speed persists in time:
+
+   to_grid               place a record on a regular time grid, NaN for gaps
+   stack_grids           do so for many stations, as rows of a 2-D array
+   autocorrelation       autocorrelation function for all lags, via FFT
+   power_spectrum        periodogram, e.g. to find diurnal and seasonal peaks
+   run_lengths           lengths of calm or above-threshold runs
+   run_length_histogram  their distribution, for many stations at once
+
+All functions take either one gridded series (1-D array) or many stations
+(2-D array, one row per station, padded with NaN), and treat NaN as missing.
+
+The autocorrelation at lag L is estimated from all pairs of samples L steps
+apart that are both present:
+
+   r(L)= sum(m_t m_t+L x_t x_t+L) / sum(m_t m_t+L) / var(x)
+
+where m is 1 where a sample is present and 0 otherwise, and x the series minus
+its mean.  Both sums are correlations, which are computed for every lag at
+once with zero-padded FFTs in O(n log n), rather than in O(n * lags) with a
+loop over lags.
+"""
+
+import numpy as np
+
+
+def to_grid(series, step=3600):
+   """
+   OVERVIEW
+
+   This function places the speeds of the `WindSeries` `series` on a regular
+   grid of `step` seconds and returns `(start, values)`, where `start` is the
+   epoch time of the first grid point and `values` holds NaN at grid points
+   without data.  Timestamps are rounded to the nearest grid point, which
+   absorbs the drift between readings on the hour and at :53 past the hour.
+   If two readings fall on the same grid point, the later one is kept.
+   """
+
+   time= np.asarray(series.time, dtype=np.int64)
+   if len(time) == 0:
+      return 0, np.empty(0)
+
+   slot= (time + step // 2) // step
+   start= int(slot.min()) * step
+   slot-= start // step
+
+   values= np.full(int(slot.max()) + 1, np.nan)
+   values[slot]= series.speed
+   return start, values
+
+
+def stack_grids(series_list, step=3600):
+   """
+   OVERVIEW
+
+   This function applies `to_grid` to every `WindSeries` in `series_list`
+   and returns `(starts, values)`: the start times and a 2-D array with one
+   row per station, padded with NaN at the end.
+   """
+
+   grids= [to_grid(series, step) for series in series_list]
+   values= np.full((len(grids), max([len(v) for _, v in grids] or [0])),
+     np.nan)
+   for row, (_, v) in enumerate(grids):
+      values[row, :len(v)]= v
+   return np.array([start for start, _ in grids], dtype=np.int64), values
+
+
+def _fft_size(n):
+   # Smallest 2^a 3^b 5^c >= n, for which FFTs are fast.
+   best= 1 << int(np.ceil(np.log2(max(n, 1))))
+   p5= 1
+   while p5 < best:
+      p35= p5
+      while p35 < best:
+         size= p35
+         while size < n:
+            size*= 2
+         best= min(best, size)
+         p35*= 3
+      p5*= 5
+   return best
+
+
+def autocorrelation(values, max_lag=None, min_pairs=1):
+   """
+   OVERVIEW
+
+   This function returns the autocorrelation function of `values` (1-D, or
+   2-D with one station per row) for lags 0 to `max_lag` (by default, the
+   whole record), with NaN marking gaps.  Lags with fewer than `min_pairs`
+   pairs of present samples are NaN.
+   """
+
+   x= np.asarray(values, dtype=np.float64)
+   one= x.ndim == 1
+   x= np.atleast_2d(x)
+   n= x.shape[1]
+   max_lag= n - 1 if max_lag is None else min(max_lag, n - 1)
+
+   present= np.isfinite(x)
+   count= present.sum(axis=1, keepdims=True)
+   with np.errstate(invalid='ignore', divide='ignore'):
+      mean= np.where(present, x, 0.0).sum(axis=1, keepdims=True) / count
+   x= np.where(present, x - mean, 0.0)
+   m= present.astype(np.float64)
+
+   size= _fft_size(n + max_lag + 1)
+   X= np.fft.rfft(x, size, axis=1)
+   M= np.fft.rfft(m, size, axis=1)
+   products= np.fft.irfft(X * X.conj(), size, axis=1)[:, :max_lag + 1]
+   pairs= np.rint(np.fft.irfft(M * M.conj(), size, axis=1)[:, :max_lag + 1])
+
+   with np.errstate(invalid='ignore', divide='ignore'):
+      covariance= products / pairs
+      acf= covariance / covariance[:, :1]
+   acf[pairs < min_pairs]= np.nan
+
+   return acf[0] if one else acf
+
+
+def power_spectrum(values, step=3600):
+   """
+   OVERVIEW
+
+   This function returns `(frequency, power)`: the periodogram of `values`
+   (1-D, or 2-D with one station per row) after subtracting the mean and
+   setting gaps to zero, and the frequencies in cycles per day.  Power is
+   scaled by the fraction of present samples, so that records with gaps remain
+   comparable.  The diurnal cycle appears at 1 cycle per day and the seasonal
+   cycle at 1/365.25.
+   """
+
+   x= np.asarray(values, dtype=np.float64)
+   one= x.ndim == 1
+   x= np.atleast_2d(x)
+   n= x.shape[1]
+
+   present= np.isfinite(x)
+   count= present.sum(axis=1, keepdims=True)
+   with np.errstate(invalid='ignore', divide='ignore'):
+      mean= np.where(present, x, 0.0).sum(axis=1, keepdims=True) / count
+      x= np.where(present, x - mean, 0.0)
+      power= np.abs(np.fft.rfft(x, axis=1)) ** 2 / count
+
+   frequency= np.fft.rfftfreq(n, step / 86400.0)
+   return frequency, power[0] if one else power
+
+
+def peak_power(frequency, power, cycles_per_day, width=1):
+   """
+   OVERVIEW
+
+   This function returns the largest power within `width` frequency bins of
+   `cycles_per_day`, e.g. `peak_power(f, p, 1.0)` for the diurnal cycle.
+   """
+
+   centre= int(np.argmin(np.abs(frequency - cycles_per_day)))
+   return np.max(power[..., max(centre - width, 0):centre + width + 1],
+     axis=-1)
+
+
+def run_lengths(values, threshold, below=True):
+   """
+   OVERVIEW
+
+   This function finds the runs of consecutive grid points whose speed is
+   below `threshold` (calm runs) or, with `below=False`, at or above it, in
+   `values` (1-D, or 2-D with one station per row).  Gaps end a run.  It
+   returns `(station, start, length)` arrays, one element per run; for 1-D
+   input, `station` is all zeros.
+   """
+
+   x= np.atleast_2d(np.asarray(values, dtype=np.float64))
+   with np.errstate(invalid='ignore'):
+      inside= (x < threshold) if below else (x >= threshold)
+   inside&= np.isfinite(x)
+
+   # A False column on both sides of every row separates the stations, so
+   # runs can be found in one pass over the flattened array:
+   rows, n= inside.shape
+   padded= np.zeros((rows, n + 2), bool)
+   padded[:, 1:-1]= inside
+   change= np.diff(padded.ravel().view(np.int8))
+   starts= np.flatnonzero(change == 1) + 1
+   ends= np.flatnonzero(change == -1) + 1
+
+   station= starts // (n + 2)
+   return station, starts - station * (n + 2) - 1, ends - starts
+
+
+def run_length_histogram(values, threshold, below=True, max_length=None):
+   """
+   OVERVIEW
+
+   This function returns a 2-D array `counts` (1-D for 1-D input) where
+   `counts[s, L]` is the number of runs of length L at station s (see
+   `run_lengths`).  Runs longer than `max_length` are counted at
+   `max_length`.
+   """
+
+   one= np.asarray(values).ndim == 1
+   x= np.atleast_2d(values)
+   station, _, length= run_lengths(x, threshold, below)
+   if max_length is None:
+      max_length= int(length.max()) if len(length) else 0
+   length= np.minimum(length, max_length)
+
+   counts= np.bincount(station * (max_length + 1) + length,
+     minlength=x.shape[0] * (max_length + 1)).reshape(x.shape[0],
+     max_length + 1)
+   return counts[0] if one else counts
@@ -0,0 +1,259 @@
+"""
+profiling.py
+
+
+OVERVIEW
+
+This module records where the time and memory of a fitting run go.  A
+`Profiler` measures named stages:
+
+   profiler= Profiler()
+   with profiler.stage('read'):
+      ...
+   print(profiler.report())
+
+For every stage it records the wall time, the CPU time of the process and,
+when memory tracing is on, the peak memory allocated during the stage (as
+traced by `tracemalloc`, above what was allocated when the stage began).
+Stages must not be nested.  A profiler created with `enabled=False` hands out
+a shared do-nothing context manager, so instrumented code costs next to
+nothing when profiling is off.
+
+The stages of the fitting pipeline are those of `main.py`:
+
+   read          read (and decompress) the station file
+   parse         convert the lines to speeds
+   moments       mean and mean of the cubed speeds
+   below-mean    fraction of speeds below the mean
+   solve         solve the moment equation for k
+   scale         derive c from k
+
+`run_pipeline` runs these stages on one station file with the vectorized code
+of this package, and `aggregate` combines the profiles of many runs.  Run as a
+script, the module profiles the station files named on the command line:
+
+   python profiling.py input.txt other.txt --json profile.json
+
+`main.py` itself is instrumented with the same stages.  Profiling it is
+switched on with the environment variable WIND_PROFILE: any value prints the
+report, and a value ending in '.json' also writes the report to that file.
+Setting WIND_PROFILE_MEMORY as well traces memory.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import math
+import time
+import tracemalloc
+
+import numpy as np
+
+import weibull
+from find_roots import find_root_bisection
+from wind_data import iter_blocks, open_station
+
+STAGES= ('read', 'parse', 'moments', 'below-mean', 'solve', 'scale')
+
+_NULL_STAGE= contextlib.nullcontext()
+
+
+class Profiler(object):
+   """
+   OVERVIEW
+
+   Records wall time, CPU time and (optionally) peak traced memory per stage.
+
+   INPUTS
+
+   `enabled`: if `False`, `stage` does nothing.
+
+   `trace_memory`: if `True`, `tracemalloc` is started (unless it is already
+   running) and the peak memory of every stage is recorded.  Tracing slows
+   down code that allocates many Python objects.
+   """
+
+   def __init__(self, enabled=True, trace_memory=False):
+      self.enabled= enabled
+      self.trace_memory= enabled and trace_memory
+      self.stages= []
+      self._started_tracing= False
+
+      if self.trace_memory and not tracemalloc.is_tracing():
+         tracemalloc.start()
+         self._started_tracing= True
+
+   def stage(self, name):
+      """This method returns a context manager that measures stage `name`."""
+      if not self.enabled:
+         return _NULL_STAGE
+      return self._measure(name)
+
+   @contextlib.contextmanager
+   def _measure(self, name):
+      if self.trace_memory:
+         tracemalloc.reset_peak()
+         base= tracemalloc.get_traced_memory()[0]
+      wall= time.perf_counter()
+      cpu= time.process_time()
+      try:
+         yield
+      finally:
+         record= {'stage': name, 'wall': time.perf_counter() - wall,
+           'cpu': time.process_time() - cpu}
+         if self.trace_memory:
+            record['peak_bytes']= tracemalloc.get_traced_memory()[1] - base
+         self.stages.append(record)
+
+   def close(self):
+      """This method stops memory tracing if this profiler started it."""
+      if self._started_tracing:
+         tracemalloc.stop()
+         self._started_tracing= False
+
+   def as_dict(self):
+      return {'stages': list(self.stages),
+        'wall': sum(record['wall'] for record in self.stages),
+        'cpu': sum(record['cpu'] for record in self.stages)}
+
+   def to_json(self, **kwargs):
+      return json.dumps(self.as_dict(), **kwargs)
+
+   def report(self):
+      """This method returns the recorded stages as a text table."""
+      return format_table(self.stages, ('wall', 'cpu', 'peak_bytes'))
+
+# end class Profiler
+
+
+def _format_value(key, value):
+   if value is None:
+      return '-'
+   if key.endswith('bytes'):
+      return '%.1f MiB' % (value / 2.0**20)
+   if key == 'runs':
+      return '%d' % value
+   return '%.4f s' % value
+
+
+def format_table(rows, keys):
+   """
+   OVERVIEW
+
+   This function renders a list of per-stage dicts as a text table with the
+   columns 'stage' and `keys`; missing values are shown as '-'.
+   """
+
+   lines= ['%-12s' % 'stage' + ''.join('%16s' % key for key in keys)]
+   for row in rows:
+      lines.append('%-12s' % row['stage'] + ''.join('%16s'
+        % _format_value(key, row.get(key)) for key in keys))
+   return '\n'.join(lines)
+
+
+def aggregate(profiles):
+   """
+   OVERVIEW
+
+   This function combines the stages of many runs (`Profiler` objects or
+   their `as_dict()` results) and returns, in order of first appearance, one
+   dict per stage with the number of runs and the total, mean and maximum of
+   wall time, CPU time and peak memory.
+   """
+
+   combined= {}
+   for profile in profiles:
+      if isinstance(profile, Profiler):
+         profile= profile.as_dict()
+      for record in profile['stages']:
+         entry= combined.setdefault(record['stage'], {'stage': record['stage'],
+           'runs': 0, 'wall': [], 'cpu': [], 'peak_bytes': []})
+         entry['runs']+= 1
+         for key in ('wall', 'cpu', 'peak_bytes'):
+            if key in record:
+               entry[key].append(record[key])
+
+   result= []
+   for entry in combined.values():
+      row= {'stage': entry['stage'], 'runs': entry['runs']}
+      for key in ('wall', 'cpu'):
+         row['total_' + key]= sum(entry[key])
+         row['mean_' + key]= sum(entry[key]) / len(entry[key])
+         row['max_' + key]= max(entry[key])
+      if entry['peak_bytes']:
+         row['max_peak_bytes']= max(entry['peak_bytes'])
+      result.append(row)
+   return result
+
+
+def run_pipeline(path, profiler=None, a=0.1, b=100.0, xtol=1.e-6, ftol=1.e-6):
+   """
+   OVERVIEW
+
+   This function fits the station file `path` as `main.py` does, measuring
+   every stage of `STAGES` with `profiler`, and returns `(k, c)`.
+   """
+
+   profiler= profiler or Profiler(enabled=False)
+
+   with profiler.stage('read'):
+      with open_station(path) as inputfile:
+         text= inputfile.read()
+
+   with profiler.stage('parse'):
+      speed= np.concatenate([block[1] for block in
+        iter_blocks(io.BytesIO(text))] or [np.empty(0)])
+      del text
+
+   with profiler.stage('moments'):
+      mean= np.average(speed)
+      mean_cube= np.average(speed ** 3)
+
+   with profiler.stage('below-mean'):
+      cumulative= np.count_nonzero(speed < mean) / len(speed)
+
+   with profiler.stage('solve'):
+      k= find_root_bisection(weibull.moment_equation(mean, mean_cube,
+        cumulative), a, b, ftol=ftol, xtol=xtol)
+
+   with profiler.stage('scale'):
+      c= mean / math.gamma(1 + 1 / k)
+
+   return k, c
+
+
+def main(argv=None):
+   parser= argparse.ArgumentParser(description="Profile the fitting pipeline "
+     "stage by stage on station files.")
+   parser.add_argument('paths', nargs='+', help="station files")
+   parser.add_argument('--memory', action='store_true',
+     help="trace peak memory per stage (slows down parsing)")
+   parser.add_argument('--json', help="also write the profiles to this file")
+   args= parser.parse_args(argv)
+
+   profiles= []
+   for path in args.paths:
+      profiler= Profiler(trace_memory=args.memory)
+      try:
+         k, c= run_pipeline(path, profiler)
+      finally:
+         profiler.close()
+      print('\n%s: k= %.6f, c= %.6f' % (path, k, c))
+      print(profiler.report())
+      profiles.append(dict(profiler.as_dict(), path=path, k=k, c=c))
+
+   summary= aggregate(profiles)
+   if len(profiles) > 1:
+      print('\nAll %d runs:' % len(profiles))
+      print(format_table(summary, ('runs', 'total_wall', 'mean_wall',
+        'max_wall', 'total_cpu', 'max_peak_bytes')))
+
+   if args.json:
+      with open(args.json, 'wt') as outputfile:
+         json.dump({'runs': profiles, 'summary': summary}, outputfile,
+           indent=1)
+
+
+if __name__ == '__main__':
+   main()
@@ -0,0 +1,246 @@
+"""
+result_cache.py
+
+
+OVERVIEW
+
+This module keeps fit results on disk so that repeated runs against unchanged
+station files do not recompute them.
+
+A result is stored under the SHA-256 hash of the station file's content and
+the fit settings (method, solver, starting values and tolerances).  For every
+file path seen, the cache also remembers its size, modification time and
+hash.  As long as size and modification time are unchanged, the stored hash is
+trusted, and a cache hit returns k, c and the solver statistics without
+opening the station file.  When either has changed, the file is hashed again.
+If the content is in fact unchanged (e.g. the file was only touched), the
+stored results remain valid.  Otherwise the results for that file's old content
+are dropped; results for other files are unaffected.
+
+Everything lives in one small JSON file.  When the file would exceed
+`max_bytes`, the least recently used results are evicted.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+from binned import SpeedHistogram
+from find_roots import (find_root, find_root_bisection, find_root_Regula_Falsi,
+  find_root_secant)
+
+DEFAULT_PATH= '.wind_fit_cache.json'
+DEFAULT_MAX_BYTES= 1 << 20
+
+SOLVERS= {
+   'bisection': find_root_bisection,
+   'secant': find_root_secant,
+   'regula_falsi': find_root_Regula_Falsi,
+   'find_root': find_root,
+}
+
+_VERSION= 1
+
+
+def counting_solver(solver, calls):
+   """
+   OVERVIEW
+
+   This function returns the solver `SOLVERS[solver]`, wrapped so that every
+   evaluation of the objective adds 1 to `calls[0]`.
+   """
+
+   def counted_solver(f, a, b, **kwargs):
+      def counted(x):
+         calls[0]+= 1
+         return f(x)
+      return SOLVERS[solver](counted, a, b, **kwargs)
+   return counted_solver
+
+
+def file_hash(path, chunk_size=1 << 20):
+   """This function returns the SHA-256 hex digest of the file `path`."""
+
+   digest= hashlib.sha256()
+   with open(path, 'rb') as inputfile:
+      for chunk in iter(lambda: inputfile.read(chunk_size), b''):
+         digest.update(chunk)
+   return digest.hexdigest()
+
+
+class ResultCache(object):
+   """
+   OVERVIEW
+
+   A persistent map from (station file content, fit settings) to results.
+
+   INPUTS
+
+   `path` is the cache file; it is created on the first `put`.
+
+   `max_bytes` is the size limit of the cache file.
+   """
+
+   def __init__(self, path=DEFAULT_PATH, max_bytes=DEFAULT_MAX_BYTES):
+      self.path= path
+      self.max_bytes= max_bytes
+
+   def _load(self):
+      try:
+         with open(self.path, 'rt') as cachefile:
+            state= json.load(cachefile)
+         if state.get('version') == _VERSION:
+            return state
+      except (IOError, OSError, ValueError):
+         pass
+      return {'version': _VERSION, 'files': {}, 'results': {}}
+
+   def _save(self, state):
+      text= json.dumps(state, separators=(',', ':'), sort_keys=True)
+
+      # Evict least recently used results until the file fits:
+      if len(text) > self.max_bytes:
+         by_age= sorted(state['results'], key=lambda key:
+           state['results'][key]['used'])
+         while by_age and len(text) > self.max_bytes:
+            excess= len(text) - self.max_bytes
+            while by_age and excess > 0:
+               key= by_age.pop(0)
+               excess-= len(json.dumps({key: state['results'].pop(key)},
+                 separators=(',', ':')))
+            text= json.dumps(state, separators=(',', ':'), sort_keys=True)
+
+      # Write atomically, so that an interrupted run cannot corrupt the cache:
+      directory= os.path.dirname(os.path.abspath(self.path))
+      handle, temporary= tempfile.mkstemp(dir=directory, suffix='.tmp')
+      try:
+         with os.fdopen(handle, 'wt') as cachefile:
+            cachefile.write(text)
+         os.replace(temporary, self.path)
+      except BaseException:
+         os.remove(temporary)
+         raise
+
+   def _dataset_key(self, state, path, verify):
+      # Returns (content hash, whether `state` was modified).
+      info= os.stat(path)
+      name= os.path.abspath(path)
+      record= state['files'].get(name)
+
+      if (record and not verify and record['size'] == info.st_size
+        and record['mtime_ns'] == info.st_mtime_ns):
+         return record['sha256'], False
+
+      sha= file_hash(path)
+      if record and record['sha256'] != sha:
+         old= record['sha256']
+         if not any(other['sha256'] == old for key, other in
+           state['files'].items() if key != name):
+            for key in [key for key in state['results']
+              if key.startswith(old + '|')]:
+               del state['results'][key]
+
+      state['files'][name]= {'size': info.st_size,
+        'mtime_ns': info.st_mtime_ns, 'sha256': sha}
+      return sha, True
+
+   @staticmethod
+   def _result_key(sha, settings):
+      return sha + '|' + json.dumps(settings, sort_keys=True,
+        separators=(',', ':'))
+
+   def get(self, path, verify=False, **settings):
+      """
+      OVERVIEW
+
+      This method returns the result stored for the station file `path` and
+      the keyword `settings`, or `None`.  With `verify` set, the file is
+      always hashed rather than trusting an unchanged size and modification
+      time.
+      """
+
+      state= self._load()
+      sha, modified= self._dataset_key(state, path, verify)
+      entry= state['results'].get(self._result_key(sha, settings))
+      if entry is not None:
+         entry['used']= time.time()
+         modified= True
+      if modified:
+         self._save(state)
+      return None if entry is None else entry['result']
+
+   def put(self, path, result, **settings):
+      """
+      OVERVIEW
+
+      This method stores `result` (a JSON-serializable dict) for the station
+      file `path` and the keyword `settings`.
+      """
+
+      state= self._load()
+      sha= self._dataset_key(state, path, False)[0]
+      state['results'][self._result_key(sha, settings)]= {'result': result,
+        'used': time.time()}
+      self._save(state)
+
+   def clear(self):
+      """This method removes the cache file."""
+      if os.path.exists(self.path):
+         os.remove(self.path)
+
+# end class ResultCache
+
+
+def fit_file(path, method='moments', solver='bisection', a=0.1, b=100.0,
+  xtol=1.e-6, ftol=1.e-6, cache=None, verify=False):
+   """
+   OVERVIEW
+
+   This function returns the Weibull fit of the station file `path` as a dict
+   with keys 'k', 'c', 'calls' (objective evaluations made by the solver),
+   'seconds' (time spent fitting) and 'cached' (whether the result came from
+   the cache).
+
+   INPUTS
+
+   `method` is 'moments' (the fit of `main.py`) or 'ml'.
+
+   `solver` is a key of `SOLVERS`; `a`, `b`, `xtol` and `ftol` are passed to
+   it.
+
+   `cache` is a `ResultCache`; the default uses `DEFAULT_PATH`.  Pass `False`
+   to disable caching.
+
+   `verify` is passed to `ResultCache.get`.
+   """
+
+   if method not in ('moments', 'ml'):
+      raise ValueError("`method` must be 'moments' or 'ml'.")
+   if solver not in SOLVERS:
+      raise ValueError("`solver` must be one of %s."
+        % ', '.join(sorted(SOLVERS)))
+
+   settings= dict(method=method, solver=solver, a=a, b=b, xtol=xtol,
+     ftol=ftol)
+
+   if cache is None:
+      cache= ResultCache()
+   if cache:
+      result= cache.get(path, verify=verify, **settings)
+      if result is not None:
+         return dict(result, cached=True)
+
+   start= time.perf_counter()
+   calls= [0]
+   hist= SpeedHistogram.from_file(path)
+   fit= hist.fit_moments if method == 'moments' else hist.fit_ml
+   k, c= fit(a=a, b=b, xtol=xtol, ftol=ftol, solver=counting_solver(solver,
+     calls))
+
+   result= {'k': float(k), 'c': float(c), 'calls': calls[0],
+     'seconds': time.perf_counter() - start}
+   if cache:
+      cache.put(path, result, **settings)
+   return dict(result, cached=False)
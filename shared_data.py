@@ -0,0 +1,349 @@
+"""
+shared_data.py
+
+
+OVERVIEW
+
+This module lets worker processes fit one station record without each of
+them reading the file again or receiving a pickled copy of the arrays.  The
+parent process loads the record once into a block of shared memory
+(`multiprocessing.shared_memory`).  Workers attach to the block by name and
+work on NumPy views of it, so memory does not grow with the number of
+workers, and only a short description of the block is sent to them.
+
+   with SharedSeries.from_file('input.txt') as shared:
+      tasks= year_tasks(shared.series, bootstrap=100)
+      results= map_fits(shared, tasks, processes=8)
+
+The block is freed when the `with` block of the parent ends (or when it calls
+`close` and `unlink`).  The arrays of `series` are views of the block: `close`
+raises `BufferError` while any of them is still alive, rather than leave it
+pointing at unmapped memory.  A worker attaches once, on its first task, and
+stays attached until it exits.  The block holds the `time`, `speed` and
+`direction` columns one after the other, each aligned to 64 bytes.
+
+Tasks are `(start, stop, replicate)` triples: the fit of rows `start` to
+`stop` of the time-sorted record, either of the rows themselves
+(`replicate` 0) or of bootstrap replicate `replicate`.  Replicates are drawn
+with a seed that depends on the record's `key` (by default, its file path) as
+well as on the task, so that records fitted with the same tasks get
+independent replicates.  A bootstrap replicate
+is fitted from the number of times every row is drawn, used as weights by
+`weibull.moment_statistics`, so no resampled copy of the data is made either.
+"""
+
+import concurrent.futures
+import math
+import os
+import time
+
+import numpy as np
+from multiprocessing import shared_memory
+
+import weibull
+from checkpoint import unit_seed
+from result_cache import counting_solver
+from wind_data import WindSeries, read_station
+
+_ALIGNMENT= 64
+
+_COLUMNS= (('time', np.int64), ('speed', np.float64),
+  ('direction', np.float64))
+
+# Blocks this process has attached to, by name (see `_attached`):
+_ATTACHED= {}
+
+
+def _open_block(name):
+   # Attaches to an existing block.  Python 3.13 and later can leave its
+   # lifetime to the creator explicitly; earlier versions share the creator's
+   # resource tracker, which already has the block registered.
+   try:
+      return shared_memory.SharedMemory(name=name, track=False)
+   except TypeError:
+      return shared_memory.SharedMemory(name=name)
+
+
+class SharedSeries(object):
+   """
+   OVERVIEW
+
+   A `WindSeries` held in shared memory.  Use `create` or `from_file` in the
+   parent process and `attach` in workers; do not call the constructor
+   directly.
+
+   `spec` is the picklable `(name, length, key)` triple that workers attach
+   with, and `series` a `WindSeries` of views into the block.  `key`
+   identifies the record in the seeds of bootstrap replicates; by default it
+   is the name of the block, which differs from run to run.
+   """
+
+   def __init__(self, block, length, owner, key=None):
+      self._block= block
+      self.key= block.name if key is None else key
+      self._attached= True
+      self._linked= owner
+      self.length= length
+      self.owner= owner
+      self.series= self._views()
+
+   def _views(self):
+      # Every view holds an export of the block's buffer, which makes
+      # detaching from the block fail while the view is alive, rather than
+      # leave it pointing at unmapped memory.
+      return WindSeries(*(np.frombuffer(self._block.buf, dtype, self.length,
+        offset) for (_, dtype), offset in zip(_COLUMNS,
+        _layout(self.length)[0])))
+
+   @property
+   def name(self):
+      return self._block.name
+
+   @property
+   def spec(self):
+      return (self._block.name, self.length, self.key)
+
+   @classmethod
+   def create(cls, series, key=None):
+      """
+      OVERVIEW
+
+      This method copies the `WindSeries` `series` into a new block of shared
+      memory, sorted by time, and returns the owning `SharedSeries` with the
+      `key` given.
+      """
+
+      if len(series) > 1 and np.any(series.time[1:] < series.time[:-1]):
+         series= series.select(np.argsort(series.time, kind='stable'))
+
+      length= len(series)
+      block= shared_memory.SharedMemory(create=True,
+        size=max(_layout(length)[1], 1))
+      try:
+         shared= cls(block, length, True, key)
+      except BaseException:
+         block.close()
+         block.unlink()
+         raise
+      try:
+         shared.series.time[:]= series.time
+         shared.series.speed[:]= series.speed
+         shared.series.direction[:]= series.direction
+      except BaseException:
+         shared.__exit__(None, None, None)
+         raise
+      return shared
+
+   @classmethod
+   def from_file(cls, path):
+      """
+      OVERVIEW
+
+      This method reads the station file `path` into shared memory, with
+      `path` as its key.
+      """
+
+      return cls.create(read_station(path), key=path)
+
+   @classmethod
+   def attach(cls, spec):
+      """This method attaches to the block described by `spec`."""
+      name, length, key= spec
+      return cls(_open_block(name), length, False, key)
+
+   def close(self):
+      """
+      OVERVIEW
+
+      This method detaches this process from the block, and `series` is no
+      longer available.  Views of the block obtained from `series` must have
+      been released; otherwise the method raises `BufferError`, and the block
+      stays mapped in this process until they are released and `close` is
+      called again.
+      """
+
+      if self._attached:
+         self.series= None
+         self._block.close()
+         self._attached= False
+
+   def unlink(self):
+      """
+      OVERVIEW
+
+      This method frees the block, once every process has detached from it;
+      only the owner may call it.
+      """
+
+      if not self.owner:
+         raise ValueError("Only the process that created the block may free "
+           "it.")
+      if self._linked:
+         self._block.unlink()
+         self._linked= False
+
+   def __del__(self):
+      # Releases the views before the block, so that the block can close
+      # itself when it is collected.
+      self.series= None
+
+   def __enter__(self):
+      return self
+
+   def __exit__(self, *exc_info):
+      # The block is unlinked even if `close` fails because views of it are
+      # still alive, so that it is freed once they are released.
+      try:
+         self.close()
+      finally:
+         if self.owner:
+            self.unlink()
+
+# end class SharedSeries
+
+
+def _layout(length):
+   # Byte offsets of the columns, and the total size, for `length` rows.
+   offsets= []
+   size= 0
+   for _, dtype in _COLUMNS:
+      offsets.append(size)
+      size+= length * np.dtype(dtype).itemsize
+      size= -(-size // _ALIGNMENT) * _ALIGNMENT
+   return offsets, size
+
+
+def _attached(spec):
+   # The block of `spec`, attached once per process.
+   shared= _ATTACHED.get(spec)
+   if shared is None:
+      shared= _ATTACHED[spec]= SharedSeries.attach(spec)
+   return shared
+
+
+def detach_all():
+   """
+   OVERVIEW
+
+   This function detaches this process from every block that `fit_task`
+   attached it to.  Workers need not call it; their blocks are detached when
+   they exit.
+   """
+
+   while _ATTACHED:
+      _ATTACHED.popitem()[1].close()
+
+
+def year_tasks(series, bootstrap=0):
+   """
+   OVERVIEW
+
+   This function returns `(labels, tasks)` for fitting every calendar year of
+   the time-sorted `WindSeries` `series`, with `bootstrap` replicates each:
+   `labels` holds the `(year, replicate)` pair of every task.
+   """
+
+   years= series.year
+   first= np.flatnonzero(np.r_[True, years[1:] != years[:-1]])
+   bounds= np.r_[first, len(years)]
+
+   labels, tasks= [], []
+   for year, start, stop in zip(years[first], bounds[:-1], bounds[1:]):
+      for replicate in range(bootstrap + 1):
+         labels.append((int(year), replicate))
+         tasks.append((int(start), int(stop), replicate))
+   return labels, tasks
+
+
+def window_tasks(series, window, step=None, bootstrap=0):
+   """
+   OVERVIEW
+
+   This function returns `(labels, tasks)` for fitting windows of `window`
+   seconds, starting every `step` seconds (by default, `window`), of the
+   time-sorted `WindSeries` `series`.  `labels` holds the `(start time,
+   replicate)` pair of every task; empty windows are left out.
+   """
+
+   step= step or window
+   if len(series) == 0:
+      return [], []
+   begin= np.arange(series.time[0], series.time[-1] + 1, step)
+   start= np.searchsorted(series.time, begin)
+   stop= np.searchsorted(series.time, begin + window)
+
+   labels, tasks= [], []
+   for t, i, j in zip(begin, start, stop):
+      if j > i:
+         for replicate in range(bootstrap + 1):
+            labels.append((int(t), replicate))
+            tasks.append((int(i), int(j), replicate))
+   return labels, tasks
+
+
+def fit_task(spec, task, seed=0, solver='bisection', a=0.1, b=100.0,
+  xtol=1.e-6, ftol=1.e-6):
+   """
+   OVERVIEW
+
+   This function runs one task on the shared record `spec` (a
+   `SharedSeries.spec`), attaching to it if this process has not yet, and
+   returns a dict with keys 'k', 'c', 'n' (number of rows), 'calls'
+   (objective evaluations made by the solver) and 'seconds'.  Bootstrap
+   replicate r draws with a seed derived from `seed`, the key of the record,
+   start and r.  The other inputs are as for `weibull.fit_moments`, with
+   `solver` a key of `result_cache.SOLVERS`.
+   """
+
+   start, stop, replicate= task
+   started= time.perf_counter()
+   speed= _attached(spec).series.speed[start:stop]
+   n= stop - start
+   if n == 0:
+      raise ValueError("The task selects no rows.")
+
+   weights= None
+   if replicate:
+      rng= np.random.default_rng([seed, unit_seed(spec[2]), start,
+        replicate])
+      weights= np.bincount(rng.integers(0, n, n), minlength=n)
+
+   mean, mean_cube, cumulative= weibull.moment_statistics(speed,
+     weights=weights)
+   calls= [0]
+   k= counting_solver(solver, calls)(weibull.moment_equation(mean, mean_cube,
+     cumulative), a, b, xtol=xtol, ftol=ftol)
+
+   return {'k': float(k), 'c': float(mean / math.gamma(1 + 1 / k)), 'n': n,
+     'calls': calls[0], 'seconds': time.perf_counter() - started}
+
+
+def _run_tasks(spec, tasks, options):
+   # Runs a chunk of tasks in one worker, so that the tasks are shipped in
+   # few messages.
+   return [fit_task(spec, task, **options) for task in tasks]
+
+
+def map_fits(shared, tasks, processes=None, chunk_size=None, **options):
+   """
+   OVERVIEW
+
+   This function runs `fit_task` for every task in `tasks` on the
+   `SharedSeries` `shared`, in a pool of `processes` worker processes (by
+   default, one per CPU), and returns the results in the order of `tasks`.
+   Tasks are sent to the workers in chunks of `chunk_size` (by default, four
+   chunks per worker).  `options` are passed to `fit_task`.
+   """
+
+   tasks= list(tasks)
+   if not tasks:
+      return []
+
+   workers= processes or os.cpu_count() or 1
+   chunk_size= chunk_size or max(1, -(-len(tasks) // (4 * workers)))
+   with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+      chunks= [tasks[i:i + chunk_size] for i in range(0, len(tasks),
+        chunk_size)]
+      futures= [pool.submit(_run_tasks, shared.spec, chunk, options) for chunk
+        in chunks]
+      return [result for future in futures for result in future.result()]
@@ -0,0 +1,137 @@
+"""
+speed_index.py
+
+
+OVERVIEW
+
+This module provides `SpeedIndex`, a query object over the empirical
+distribution of one dataset's wind speeds.  It is built once per dataset, by
+sorting the speeds or from a `binned.SpeedHistogram`, and stores the distinct
+speeds with cumulative counts.  Recorded speeds are quantized, so the index
+holds only a few hundred entries whatever the length of the record.
+
+Batches of queries are answered with `numpy.searchsorted`, in O(q log n) for q
+queries:
+
+   fraction_below(x)        fraction of samples < x; for x= mean this is the
+                            `cumulative` of `main.py`, exactly
+   fraction_at_or_below(x)  fraction of samples <= x (the empirical CDF)
+   exceedance(x)            fraction of samples > x
+   fraction_between(a, b)   fraction of samples with a <= speed < b, e.g.
+                            the time between cut-in and cut-out speeds
+   quantile(q)              empirical quantiles, as `numpy.quantile`
+
+All counts are integers, so the fractions are exact ratios of sample counts.
+"""
+
+import numpy as np
+
+
+class SpeedIndex(object):
+   """
+   OVERVIEW
+
+   Sorted-index query object over a sample of wind speeds.
+
+   INPUTS
+
+   `speeds` is an array of wind speeds; NaNs are dropped.
+
+   `presorted` may be set to `True` when `speeds` is already sorted.
+
+   `sample_hours` is the duration represented by one sample, used by
+   `hours_between`; 1 for hourly records.
+   """
+
+   def __init__(self, speeds=(), presorted=False, sample_hours=1.0):
+      speeds= np.asarray(speeds, dtype=np.float64)
+      speeds= speeds[np.isfinite(speeds)]
+      if not presorted:
+         speeds= np.sort(speeds)
+
+      starts= np.flatnonzero(np.r_[True, speeds[1:] != speeds[:-1]]) if len(
+        speeds) else np.empty(0, np.int64)
+      self.values= speeds[starts]
+      # cum[i] is the number of samples <= values[i]:
+      self.cum= np.r_[starts[1:], len(speeds)].astype(np.int64) if len(
+        speeds) else np.empty(0, np.int64)
+      self.sample_hours= sample_hours
+
+   @classmethod
+   def from_histogram(cls, hist, sample_hours=1.0):
+      """This method builds the index from a `binned.SpeedHistogram`."""
+      index= cls(sample_hours=sample_hours)
+      nonzero= np.flatnonzero(hist.counts)
+      index.values= nonzero / hist.bins_per_unit
+      index.cum= np.cumsum(hist.counts[nonzero])
+      return index
+
+   @property
+   def n(self):
+      """Number of samples."""
+      return int(self.cum[-1]) if len(self.cum) else 0
+
+   def _count_below(self, x, side):
+      # Number of samples < x (side='left') or <= x (side='right').
+      position= np.searchsorted(self.values, x, side=side)
+      return np.where(position > 0, self.cum[np.maximum(position - 1, 0)], 0)
+
+   def count_below(self, x):
+      """This method returns the number of samples strictly below `x`."""
+      return self._count_below(x, 'left')
+
+   def fraction_below(self, x):
+      """This method returns the fraction of samples strictly below `x`."""
+      return self._count_below(x, 'left') / self.n
+
+   def fraction_at_or_below(self, x):
+      """This method returns the fraction of samples at or below `x`."""
+      return self._count_below(x, 'right') / self.n
+
+   def exceedance(self, x):
+      """This method returns the fraction of samples strictly above `x`."""
+      return (self.n - self._count_below(x, 'right')) / self.n
+
+   def fraction_between(self, low, high):
+      """
+      OVERVIEW
+
+      This method returns the fraction of samples with `low` <= speed <
+      `high`.  With the cut-in and cut-out speeds of a turbine, this is the
+      fraction of time it operates.
+      """
+
+      return (self._count_below(high, 'left') -
+        self._count_below(low, 'left')) / self.n
+
+   def hours_between(self, low, high):
+      """This method returns `fraction_between` as a number of hours."""
+      return (self._count_below(high, 'left') -
+        self._count_below(low, 'left')) * self.sample_hours
+
+   def quantile(self, q):
+      """
+      OVERVIEW
+
+      This method returns the empirical quantile(s) `q` (in [0, 1]) with the
+      linear interpolation used by `numpy.quantile`.  For example,
+      `quantile([0.5, 0.9, 0.99])` returns the P50, P90 and P99 speeds.
+      """
+
+      q= np.asarray(q, dtype=np.float64)
+      if np.any((q < 0.0) | (q > 1.0)):
+         raise ValueError("Quantiles must be in the interval [0, 1].")
+      if self.n == 0:
+         raise ValueError("The index is empty.")
+
+      position= q * (self.n - 1)
+      lo= np.floor(position)
+      frac= position - lo
+
+      # Order statistic j (0-based) is the first value with cum > j:
+      x_lo= self.values[np.searchsorted(self.cum, lo, side='right')]
+      x_hi= self.values[np.searchsorted(self.cum, np.minimum(lo + 1,
+        self.n - 1), side='right')]
+      return x_lo + frac * (x_hi - x_lo)
+
+# end class SpeedIndex
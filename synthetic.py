@@ -0,0 +1,314 @@
+"""
+synthetic.py
+
+
+OVERVIEW
+
+This module generates synthetic station records with prescribed Weibull
+parameters and writes them in the layout of `input.txt`, so that the rest of
+the package can be exercised at production scale.
+
+Speeds are produced as follows.  Two independent Gaussian AR(1) series X and Y
+with unit variance and lag-1 autocorrelation `autocorrelation` are drawn;
+E= (X^2 + Y^2) / 2 is then exactly exponentially distributed, and
+c * E^(1/k) is exactly Weibull(k, c) while inheriting the persistence of the
+Gaussian series.  Speeds are rounded to `speed_resolution`.  Directions are
+drawn from equal-width sectors with the probabilities `direction_weights`;
+calm readings get the direction 999, as in `input.txt`.
+
+Gaps are removed runs of consecutive time steps.  Everything is generated and
+formatted in chunks of `chunk_rows` rows with NumPy operations only, so files
+of 10^9 rows can be written with bounded memory.
+"""
+
+import math
+
+import numpy as np
+
+from wind_data import CALM_DIRECTION
+
+HEADER= b'DATE\tWIND SPEED\tWIND DIRECTION\n'
+
+# Time step (seconds) of the supported record resolutions:
+RESOLUTIONS= {'hourly': 3600, '10-minute': 600, '1-second': 1}
+
+# Default start of a synthetic record (2018-01-01 00:00):
+START= 1514764800
+
+# Last timestamp that fits the four-digit years of the layout (9999-12-31
+# 23:59:59):
+LAST_TIME= 253402300799
+
+
+def ar1_filter(e, phi):
+   """
+   OVERVIEW
+
+   This function returns y with y[t]= phi * y[t-1] + e[t] and y[-1]= 0,
+   computed without a Python loop over t.
+
+   The series is cut into blocks of length L, chosen so that phi^L is about
+   1e-8.  Within a block, y is a scaled cumulative sum.  The values carried
+   from one block to the next obey the same recursion with coefficient
+   phi^L, which is solved by a recursive call.
+   """
+
+   e= np.asarray(e, dtype=np.float64)
+   n= len(e)
+   if phi == 0.0 or n <= 1:
+      return e.copy()
+
+   if abs(phi) < 1.e-3:
+      # Direct truncated expansion; the neglected terms are below 1e-18.
+      y= e.copy()
+      term= e
+      for j in range(1, 7):
+         term= phi * term[:-1]
+         y[j:]+= term
+      return y
+
+   L= int(math.ceil(8.0 * math.log(10.0) / -math.log(abs(phi))))
+   L= min(n, max(2, L))
+   m= -(-n // L)
+   padded= np.zeros(m * L)
+   padded[:n]= e
+   blocks= padded.reshape(m, L)
+
+   powers= phi ** np.arange(L)
+   local= powers * np.cumsum(blocks / powers, axis=1)
+   if m == 1:
+      return local.reshape(-1)[:n]
+
+   # Value at the end of every block, including what flowed in from earlier
+   # blocks:
+   carry= ar1_filter(local[:, -1], phi ** L)
+   local[1:]+= np.outer(carry[:-1], phi * powers)
+   return local.reshape(-1)[:n]
+
+
+class SeriesGenerator(object):
+   """
+   OVERVIEW
+
+   Generates a synthetic record chunk by chunk, keeping the autocorrelated
+   state between chunks.
+
+   INPUTS
+
+   `k` and `c` are the Weibull shape and scale parameters.
+
+   `resolution` is a key of `RESOLUTIONS` or a time step in seconds.
+
+   `direction_weights` are the probabilities of equal-width direction sectors,
+   the first centred on north; the default is uniform over 12 sectors.
+
+   `autocorrelation` is the lag-1 autocorrelation of the underlying Gaussian
+   series (the speed autocorrelation is about its square).
+
+   `gap_fraction` is the fraction of time steps to drop, in runs whose length
+   is geometrically distributed with mean `gap_length`.
+
+   `speed_resolution` is the rounding step of the written speeds.
+
+   `start` is the first timestamp, in epoch seconds.
+
+   `seed` seeds the NumPy random generator.
+   """
+
+   def __init__(self, k=2.0, c=7.0, resolution='hourly',
+     direction_weights=None, autocorrelation=0.9, gap_fraction=0.0,
+     gap_length=24.0, speed_resolution=0.1, start=START, seed=None):
+
+      if k <= 0.0 or c <= 0.0:
+         raise ValueError("`k` and `c` must be positive.")
+      if not -1.0 < autocorrelation < 1.0:
+         raise ValueError("`autocorrelation` must be in the interval (-1, 1).")
+      if not 0.0 <= gap_fraction < 1.0:
+         raise ValueError("`gap_fraction` must be in the interval [0, 1).")
+      if gap_length < 1.0:
+         raise ValueError("`gap_length` must be at least 1.")
+
+      self.k= k
+      self.c= c
+      self.step= RESOLUTIONS.get(resolution, resolution)
+      if not isinstance(self.step, int) or self.step <= 0:
+         raise ValueError("`resolution` must be one of %s or a positive "
+           "number of seconds." % ', '.join(sorted(RESOLUTIONS)))
+
+      if direction_weights is None:
+         direction_weights= np.ones(12)
+      direction_weights= np.asarray(direction_weights, dtype=np.float64)
+      self.direction_cdf= np.cumsum(direction_weights) / direction_weights.sum()
+
+      self.phi= autocorrelation
+      self.gap_fraction= gap_fraction
+      self.gap_length= gap_length
+      self.speed_resolution= speed_resolution
+      self.rng= np.random.default_rng(seed)
+
+      self.time= start
+      self.state= np.zeros(2)
+      self.in_gap= True
+      self.run_left= 0
+
+   def _gaussian(self, n):
+      # Two unit-variance AR(1) series, continuing from `self.state`.
+      e= self.rng.standard_normal((2, n)) * math.sqrt(1.0 - self.phi ** 2)
+      e[:, 0]+= self.phi * self.state
+      xy= np.vstack([ar1_filter(row, self.phi) for row in e])
+      self.state= xy[:, -1]
+      return xy
+
+   def _keep(self, n):
+      # Alternating runs of kept rows and gaps with geometric lengths: gaps
+      # have mean length `gap_length`, and kept runs are sized so that the
+      # long-run gap fraction is `gap_fraction`.  The current run carries over
+      # to the next chunk.
+      if self.gap_fraction == 0.0:
+         return np.ones(n, bool)
+
+      mean_kept= self.gap_length * (1.0 - self.gap_fraction) / self.gap_fraction
+      keep= np.empty(n, bool)
+      start= 0
+      while start < n:
+         if self.run_left == 0:
+            self.in_gap= not self.in_gap
+            mean= self.gap_length if self.in_gap else mean_kept
+            self.run_left= int(self.rng.geometric(min(1.0, 1.0 / mean)))
+         stop= min(n, start + self.run_left)
+         keep[start:stop]= not self.in_gap
+         self.run_left-= stop - start
+         start= stop
+      return keep
+
+   def chunk(self, n):
+      """
+      OVERVIEW
+
+      This method returns the next `n` time steps as a `(time, speed,
+      direction)` tuple of arrays, with gap rows already removed.
+      """
+
+      time= self.time + self.step * np.arange(n, dtype=np.int64)
+      self.time+= self.step * n
+
+      x, y= self._gaussian(n)
+      speed= self.c * (0.5 * (x*x + y*y)) ** (1.0 / self.k)
+      speed= np.round(speed / self.speed_resolution) * self.speed_resolution
+      speed= np.round(speed, 6)
+
+      sectors= len(self.direction_cdf)
+      sector= np.searchsorted(self.direction_cdf, self.rng.random(n),
+        side='right')
+      width= 360.0 / sectors
+      direction= np.floor((sector - 0.5 + self.rng.random(n)) * width) % 360
+      direction[direction == 0]= 360
+      direction[speed == 0.0]= CALM_DIRECTION
+
+      keep= self._keep(n)
+      return time[keep], speed[keep], direction[keep]
+
+# end class SeriesGenerator
+
+
+def _digits(value, width):
+   # Right-aligned decimal digits of non-negative integers, with leading zeros
+   # replaced by 0 bytes (dropped when the line is assembled).
+   digits= np.empty((len(value), width), np.uint8)
+   rest= value.copy()
+   for j in range(width - 1, -1, -1):
+      digits[:, j]= rest % 10 + ord('0')
+      rest//= 10
+   if np.any(rest):
+      raise ValueError("Value too large to format.")
+
+   leading= np.cumsum(digits[:, :-1] != ord('0'), axis=1) == 0
+   digits[:, :-1][leading]= 0
+   return digits
+
+
+def _two(value):
+   # Zero-padded two-digit fields.
+   return np.stack([value // 10 + ord('0'), value % 10 + ord('0')],
+     axis=1).astype(np.uint8)
+
+
+def format_rows(time, speed, direction, seconds=False):
+   """
+   OVERVIEW
+
+   This function formats rows in the layout of `input.txt` and returns them as
+   `bytes`.  Speeds are written with one decimal and directions as integers.
+   With `seconds` set, times are written as 'HH:MM:SS'.
+   """
+
+   time= np.asarray(time, dtype=np.int64)
+   day_number= time // 86400
+   seconds_of_day= time - 86400 * day_number
+
+   months= day_number.astype('datetime64[D]').astype('datetime64[M]')
+   day= day_number - months.astype('datetime64[D]').astype(np.int64) + 1
+   month= months.astype(np.int64) % 12 + 1
+   year= months.astype(np.int64) // 12 + 1970
+   if len(year) and (year.min() < 1970 or year.max() > 9999):
+      raise ValueError("Only years 1970 to 9999 can be written in the "
+        "station layout.")
+
+   tenths= np.rint(np.asarray(speed) * 10).astype(np.int64)
+
+   n= len(time)
+   slash= np.full((n, 1), ord('/'), np.uint8)
+   colon= np.full((n, 1), ord(':'), np.uint8)
+   tab= np.full((n, 1), ord('\t'), np.uint8)
+   parts= [_two(day), slash, _two(month), slash, _two(year // 100),
+     _two(year % 100), np.full((n, 1), ord(' '), np.uint8),
+     _two(seconds_of_day // 3600), colon, _two(seconds_of_day // 60 % 60)]
+   if seconds:
+      parts+= [colon, _two(seconds_of_day % 60)]
+   parts+= [tab, _digits(tenths // 10, 3), np.full((n, 1), ord('.'), np.uint8),
+     (tenths % 10 + ord('0')).astype(np.uint8)[:, None], tab,
+     _digits(np.asarray(direction).astype(np.int64), 3),
+     np.full((n, 1), ord('\n'), np.uint8)]
+
+   rows= np.hstack(parts)
+   return rows[rows != 0].tobytes()
+
+
+def max_steps(resolution, start=START):
+   """
+   OVERVIEW
+
+   This function returns the largest number of time steps of `resolution` (a
+   key of `RESOLUTIONS` or seconds) from `start` whose timestamps can be
+   written, i.e. that end by `LAST_TIME`.
+   """
+
+   step= RESOLUTIONS.get(resolution, resolution)
+   return max((LAST_TIME - start) // step + 1, 0)
+
+
+def write_station(path, n, chunk_rows=1 << 20, **kwargs):
+   """
+   OVERVIEW
+
+   This function writes a synthetic record of `n` time steps (before gaps are
+   removed) to `path` and returns the number of rows written.  The remaining
+   keyword arguments are passed to `SeriesGenerator`.  A record that would run
+   past `LAST_TIME` raises `ValueError` before anything is written.
+   """
+
+   generator= SeriesGenerator(**kwargs)
+   if n > max_steps(generator.step, generator.time):
+      raise ValueError("%d steps of %d s run past the year 9999; use a finer "
+        "resolution or fewer rows." % (n, generator.step))
+   rows= 0
+   with open(path, 'wb') as outputfile:
+      outputfile.write(HEADER)
+      while n > 0:
+         size= min(n, chunk_rows)
+         time, speed, direction= generator.chunk(size)
+         outputfile.write(format_rows(time, speed, direction,
+           seconds=generator.step % 60 != 0))
+         rows+= len(time)
+         n-= size
+   return rows
@@ -0,0 +1,324 @@
+"""
+weibull.py
+
+
+OVERVIEW
+
+This module contains the two-parameter Weibull fits used by `main.py`, written
+as functions of summary statistics so that they can be driven from raw samples,
+from binned counts (see `binned.py`), or from any other source of the same
+sums.
+
+The moment fit solves the equation used in `main.py`,
+
+   cumulative + exp(-(mean / (meanCube / Gamma(1 + 3/k))^(1/3))^k) - 1 = 0,
+
+for the shape parameter `k`, and then takes the scale parameter as
+c= mean / Gamma(1 + 1/k).  The maximum-likelihood (ML) fit solves the usual
+ML shape equation for weighted samples.
+"""
+
+import math
+
+import numpy as np
+
+from find_roots import AlgorithmFailure, find_root_bisection
+
+
+def moment_statistics(speeds, where=None, weights=None):
+   """
+   OVERVIEW
+
+   This function returns the `(mean, meanCube, cumulative)` triple computed by
+   `main.py`: the mean speed, the mean of the cubed speeds, and the fraction of
+   samples strictly below the mean.  If the boolean array `where` is given,
+   only the samples where it is true are used, without copying them out (see
+   `filters.py`).  If `weights` is given, every sample counts `weights` times,
+   e.g. the counts of a bootstrap resample (see `shared_data.py`).
+   """
+
+   speeds= np.asarray(speeds, dtype=np.float64)
+   if weights is not None:
+      weights= np.asarray(weights, dtype=np.float64)
+      if where is not None:
+         weights= np.where(where, weights, 0.0)
+      n= weights.sum()
+      if n <= 0.0:
+         raise ValueError("No samples are selected.")
+      mean= np.dot(weights, speeds) / n
+      mean_cube= np.dot(weights, np.power(speeds, 3)) / n
+      cumulative= np.dot(weights, speeds < mean) / n
+      return mean, mean_cube, cumulative
+
+   if where is not None:
+      n= np.count_nonzero(where)
+      if n == 0:
+         raise ValueError("No samples are selected.")
+      mean= np.add.reduce(speeds, where=where) / n
+      mean_cube= np.add.reduce(np.power(speeds, 3), where=where) / n
+      cumulative= np.count_nonzero((speeds < mean) & where) / n
+      return mean, mean_cube, cumulative
+
+   mean= np.average(speeds, axis=0)
+   mean_cube= np.average(np.power(speeds, 3), axis=0)
+   cumulative= np.count_nonzero(speeds < mean) / len(speeds)
+   return mean, mean_cube, cumulative
+
+
+def moment_equation(mean, mean_cube, cumulative):
+   """
+   OVERVIEW
+
+   This function returns the objective `f(k)` whose root is the moment-fit
+   shape parameter.
+   """
+
+   def f(x):
+      return cumulative + math.exp(-(mean / ((mean_cube / math.gamma(1 + 3 / x))
+        ** (1 / 3))) ** x) - 1
+
+   return f
+
+
+def fit_moments(mean, mean_cube, cumulative, a=0.1, b=100.0, ftol=1.e-6,
+  xtol=1.e-6, solver=find_root_bisection):
+   """
+   OVERVIEW
+
+   This function returns the moment-fit Weibull parameters `(k, c)`.
+
+   INPUTS
+
+   `mean`, `mean_cube` and `cumulative` are as returned by `moment_statistics`.
+
+   `a` and `b` are the starting values handed to `solver`; the defaults are
+   the bracket used by `main.py`.
+
+   `ftol` and `xtol` are passed through to `solver`, which may be any of the
+   functions in `find_roots.py`.
+   """
+
+   k= solver(moment_equation(mean, mean_cube, cumulative), a, b, ftol=ftol,
+     xtol=xtol)
+   return k, mean / math.gamma(1 + 1 / k)
+
+
+def ml_equation(values, weights=None):
+   """
+   OVERVIEW
+
+   This function returns the ML shape equation
+
+      g(k)= sum(w x^k ln x) / sum(w x^k) - 1/k - sum(w ln x) / sum(w),
+
+   which is increasing in `k` and vanishes at the ML estimate.  Values are
+   scaled by their maximum before being raised to the power `k`, which leaves
+   g unchanged but avoids overflow for large `k`.  Every value must be
+   positive.  `k` may be an array, in which case g is evaluated at all of its
+   elements at once (see `find_roots.find_root_ksection`).
+   """
+
+   values= np.asarray(values, dtype=np.float64)
+   weights= (np.ones_like(values) if weights is None
+     else np.asarray(weights, dtype=np.float64))
+
+   if np.any(values <= 0.0):
+      raise ValueError("The Weibull ML fit requires positive values; drop or "
+        "model calm readings separately.")
+
+   log_values= np.log(values / values.max())
+   mean_log= np.dot(weights, log_values) / weights.sum()
+
+   def g(k):
+      k= np.asarray(k, dtype=np.float64)
+      w= weights * np.exp(np.multiply.outer(k, log_values))
+      return w.dot(log_values) / w.sum(axis=-1) - 1.0 / k - mean_log
+
+   return g
+
+
+def fit_ml(values, weights=None, a=0.1, b=100.0, ftol=1.e-9, xtol=1.e-6,
+  solver=find_root_bisection):
+   """
+   OVERVIEW
+
+   This function returns the maximum-likelihood Weibull parameters `(k, c)`
+   of `values`, where each value optionally carries a (count) weight.  The
+   inputs after `weights` are as for `fit_moments`.
+   """
+
+   values= np.asarray(values, dtype=np.float64)
+   weights= (np.ones_like(values) if weights is None
+     else np.asarray(weights, dtype=np.float64))
+
+   k= solver(ml_equation(values, weights), a, b, ftol=ftol, xtol=xtol)
+
+   scale= values.max()
+   mean_power= np.dot(weights, (values / scale) ** k) / weights.sum()
+   c= scale * mean_power ** (1 / k)
+   return k, c
+
+
+def _nonzero_weights(values, weights):
+   # Values with positive weight, and their weights normalized to sum 1.
+   # Zero-weight values (e.g. empty bins of a common grid) must not bound the
+   # location parameter.
+   values= np.asarray(values, dtype=np.float64)
+   if weights is None:
+      return values, np.full(len(values), 1.0 / len(values))
+   weights= np.asarray(weights, dtype=np.float64)
+   keep= weights > 0.0
+   return values[keep], weights[keep] / weights[keep].sum()
+
+
+def ml3_equations(values, weights=None):
+   """
+   OVERVIEW
+
+   This function returns the ML score equations of the three-parameter
+   Weibull distribution, F(x)= 1 - exp(-((x - u) / c)^k) for x > u, as a
+   function of the parameter vector p= (k, c, u):
+
+      1/k + <ln z> - <z^k ln z>           (d/dk)
+      <z^k> - 1                           (d/dc)
+      (k/c) <z^(k-1)> - (k - 1) <1/(x-u)> (d/du)
+
+   where z= (x - u) / c and <.> is the weighted mean over `values`.  The
+   function returns NaNs outside the domain k > 0, c > 0, u < min(values).
+   """
+
+   values, weights= _nonzero_weights(values, weights)
+   lowest= values.min()
+
+   def F(p):
+      k, c, u= p
+      if k <= 0.0 or c <= 0.0 or u >= lowest:
+         return np.full(3, np.nan)
+      z= (values - u) / c
+      log_z= np.log(z)
+      z_k= np.exp(k * log_z)
+      return np.array([
+         1.0 / k + np.dot(weights, log_z) - np.dot(weights, z_k * log_z),
+         np.dot(weights, z_k) - 1.0,
+         k / c * np.dot(weights, z_k / z) - (k - 1.0) * np.dot(weights,
+           1.0 / (values - u)),
+      ])
+
+   return F
+
+
+def moments3_start(values, weights=None):
+   """
+   OVERVIEW
+
+   This function returns the method-of-moments estimate `(k, c, u)` of the
+   three-parameter Weibull distribution, which matches the mean, variance and
+   skewness of `values`; it serves as the starting point of `fit_ml3`.  The
+   skewness equation is solved for k with `find_root_bisection`.  If the
+   sample skewness is out of the range of the Weibull family, the
+   two-parameter ML fit with u= 0 is returned instead.
+   """
+
+   values, weights= _nonzero_weights(values, weights)
+
+   mean= np.dot(weights, values)
+   var= np.dot(weights, (values - mean) ** 2)
+   skew= np.dot(weights, (values - mean) ** 3) / var ** 1.5
+
+   def skewness(k):
+      g1, g2, g3= (math.gamma(1 + i / k) for i in (1, 2, 3))
+      return (g3 - 3*g1*g2 + 2*g1**3) / (g2 - g1**2) ** 1.5 - skew
+
+   try:
+      k= find_root_bisection(skewness, 0.5, 50.0, ftol=1.e-9, xtol=1.e-6)
+   except AlgorithmFailure:
+      return fit_ml(values, weights) + (0.0,)
+
+   g1, g2= math.gamma(1 + 1 / k), math.gamma(1 + 2 / k)
+   c= math.sqrt(var / (g2 - g1 ** 2))
+   u= min(mean - c * g1, values.min() - 0.01 * c)
+   return k, c, u
+
+
+def fit_ml3(values, weights=None, p0=None, ftol=1.e-9, xtol=1.e-9,
+  solver=None):
+   """
+   OVERVIEW
+
+   This function returns the maximum-likelihood three-parameter Weibull
+   parameters `(k, c, u)` of `values`, solving the three score equations of
+   `ml3_equations` jointly with a solver from `find_roots_nd.py` (by default,
+   `find_root_newton`).
+
+   `p0` is the starting point; by default the method-of-moments estimate of
+   `moments3_start`.  Newton's method on the score equations only converges
+   from a nearby start (far away, |F| also decreases as u tends to minus
+   infinity).  Note that the three-parameter likelihood
+   has no maximum when the data call for k < 1; the solver then fails with
+   `AlgorithmFailure`.
+   """
+
+   from find_roots_nd import find_root_newton
+
+   if p0 is None:
+      p0= moments3_start(values, weights)
+   k, c, u= (solver or find_root_newton)(ml3_equations(values, weights), p0,
+     ftol=ftol, xtol=xtol)
+   return k, c, u
+
+
+def fit_ml3_batch(values, weights, p0=None, ftol=1.e-9, xtol=1.e-9,
+  full_output=False):
+   """
+   OVERVIEW
+
+   This function fits the three-parameter Weibull distribution to m samples
+   at once, e.g. the speed histograms of m stations on a common bin grid.
+
+   INPUTS
+
+   `values` is the common array of (positive) sample values, such as bin
+   speeds.
+
+   `weights` is an m-by-len(values) array of counts; zero counts are allowed.
+
+   `p0` is an m-by-3 array of starting points; by default `moments3_start` of
+   every row.
+
+   `full_output` is passed to `find_roots_nd.find_root_newton_batch`.
+
+   The function returns an m-by-3 array of `(k, c, u)` rows.
+   """
+
+   from find_roots_nd import find_root_newton_batch
+
+   values= np.asarray(values, dtype=np.float64)
+   weights= np.asarray(weights, dtype=np.float64)
+   weights= weights / weights.sum(axis=1, keepdims=True)
+   present= weights > 0.0
+   lowest= np.where(present, values, np.inf).min(axis=1)
+
+   if p0 is None:
+      p0= np.array([moments3_start(values[row], w[row])
+        for w, row in zip(weights, present)])
+
+   def F(P, rows):
+      k, c, u= P[:, 0:1], P[:, 1:2], P[:, 2:3]
+      w= weights[rows]
+      inside= (k[:, 0] > 0.0) & (c[:, 0] > 0.0) & (u[:, 0] < lowest[rows])
+      with np.errstate(all='ignore'):
+         gap= np.where(present[rows], values - u, 1.0)
+         log_z= np.log(gap / c)
+         z_k= np.exp(k * log_z)
+         result= np.stack([
+            1.0 / k[:, 0] + np.sum(w * log_z, axis=1) -
+              np.sum(w * z_k * log_z, axis=1),
+            np.sum(w * z_k, axis=1) - 1.0,
+            k[:, 0] / c[:, 0] * np.sum(w * z_k * c / gap, axis=1) -
+              (k[:, 0] - 1.0) * np.sum(w / gap, axis=1),
+         ], axis=1)
+      result[~inside]= np.nan
+      return result
+
+   return find_root_newton_batch(F, p0, ftol=ftol, xtol=xtol,
+     full_output=full_output)
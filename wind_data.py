@@ -0,0 +1,244 @@
+"""
+wind_data.py
+
+
+OVERVIEW
+
+This module reads station files in the layout of `input.txt`:
+
+   DATE	WIND SPEED	WIND DIRECTION
+   01/01/2018 00:00	1.6	112
+   ...
+
+into NumPy columns.  Rather than splitting and converting one line at a time
+(as `main.py` does), the file is read in large blocks and every block is
+converted with a handful of vectorized operations, so that the cost per row is
+dominated by NumPy rather than by the Python interpreter.
+
+Station files may be compressed with gzip, bzip2 or xz; the format is
+recognized from the first bytes of the file, and the file is decompressed as
+a stream while it is parsed, never to disk.  `read_stations` reads many files
+in a pool of threads.  zlib, bz2 and lzma release the GIL while they
+decompress, so decompressing the next files overlaps with parsing and fitting
+the current one.
+
+Times may also carry seconds ('HH:MM:SS'), as in high-rate records.
+Timestamps are returned as int64 seconds since 1970-01-01 00:00 (the station
+clock is taken as-is; no time zone conversion is done).  A direction of 999
+(`CALM_DIRECTION`) marks calm or variable wind.
+"""
+
+import bz2
+import collections
+import concurrent.futures
+import gzip
+import lzma
+
+import numpy as np
+
+CALM_DIRECTION= 999
+
+# Default number of bytes handed to the parser at a time:
+BLOCK_SIZE= 1 << 22
+
+# Leading bytes and openers of the recognized compression formats:
+COMPRESSIONS= collections.OrderedDict([
+   ('gzip', (b'\x1f\x8b', gzip.open)),
+   ('bz2', (b'BZh', bz2.open)),
+   ('xz', (b'\xfd7zXZ\x00', lzma.open)),
+])
+
+
+class WindSeries(object):
+   """
+   OVERVIEW
+
+   A station record held as three equal-length NumPy columns: `time` (int64
+   epoch seconds), `speed` (float64, m/s) and `direction` (float64, degrees).
+   """
+
+   def __init__(self, time, speed, direction):
+      self.time= np.asarray(time, dtype=np.int64)
+      self.speed= np.asarray(speed, dtype=np.float64)
+      self.direction= np.asarray(direction, dtype=np.float64)
+
+      if not len(self.time) == len(self.speed) == len(self.direction):
+         raise ValueError("`time`, `speed` and `direction` must have the "
+           "same length.")
+
+   def __len__(self):
+      return len(self.speed)
+
+   @property
+   def hour(self):
+      """Hour of day (0-23) of every sample."""
+      return (self.time // 3600) % 24
+
+   @property
+   def month(self):
+      """Month (1-12) of every sample."""
+      months= self.time.astype('datetime64[s]').astype('datetime64[M]')
+      return months.astype(np.int64) % 12 + 1
+
+   @property
+   def year(self):
+      """Calendar year of every sample."""
+      years= self.time.astype('datetime64[s]').astype('datetime64[Y]')
+      return years.astype(np.int64) + 1970
+
+   def select(self, mask):
+      """Return a new `WindSeries` holding the rows where `mask` is true."""
+      return WindSeries(self.time[mask], self.speed[mask],
+        self.direction[mask])
+
+# end class WindSeries
+
+
+def parse_block(block):
+   """
+   OVERVIEW
+
+   This function converts a `bytes` object holding complete data lines (no
+   header) into a `(time, speed, direction)` tuple of NumPy arrays.
+   """
+
+   tokens= block.split()
+   if len(tokens) % 4:
+      raise ValueError("Malformed station data: expected four fields per "
+        "line (date, time, speed, direction).")
+
+   if not tokens:
+      return (np.empty(0, np.int64), np.empty(0, np.float64),
+        np.empty(0, np.float64))
+
+   # 'dd/mm/yyyy' and 'HH:MM' (or 'HH:MM:SS') are fixed-width, so their
+   # digits can be picked out of a uint8 view of the byte strings:
+   d= np.array(tokens[0::4], dtype='S10').view(np.uint8).reshape(-1, 10)
+   d= d.astype(np.int64) - ord('0')
+   t= np.array(tokens[1::4], dtype='S8').view(np.uint8).reshape(-1, 8)
+   has_seconds= t[:, 5] == ord(':')
+   t= t.astype(np.int64) - ord('0')
+
+   day= 10*d[:, 0] + d[:, 1]
+   month= 10*d[:, 3] + d[:, 4]
+   year= 1000*d[:, 6] + 100*d[:, 7] + 10*d[:, 8] + d[:, 9]
+   hour= 10*t[:, 0] + t[:, 1]
+   minute= 10*t[:, 3] + t[:, 4]
+   second= np.where(has_seconds, 10*t[:, 6] + t[:, 7], 0)
+
+   months= ((year - 1970) * 12 + month - 1).astype('datetime64[M]')
+   days= months.astype('datetime64[D]').astype(np.int64) + day - 1
+   time= days * 86400 + hour * 3600 + minute * 60 + second
+
+   speed= np.array(tokens[2::4]).astype(np.float64)
+   direction= np.array(tokens[3::4]).astype(np.float64)
+
+   return time, speed, direction
+
+
+def iter_blocks(inputfile, block_size=BLOCK_SIZE):
+   """
+   OVERVIEW
+
+   This generator reads a binary file object in chunks of about `block_size`
+   bytes, skips the header line, and yields `(time, speed, direction)` tuples,
+   one per chunk.  Chunks are always cut at a line boundary.
+   """
+
+   rest= b''
+   header= True
+
+   while True:
+      chunk= inputfile.read(block_size)
+      if not chunk:
+         break
+
+      chunk= rest + chunk
+      if header:
+         newline= chunk.find(b'\n')
+         if newline < 0:
+            rest= chunk
+            continue
+         chunk= chunk[newline+1:]
+         header= False
+
+      newline= chunk.rfind(b'\n')
+      if newline < 0:
+         rest= chunk
+         continue
+      rest= chunk[newline+1:]
+
+      yield parse_block(chunk[:newline+1])
+
+   if rest.strip() and not header:
+      yield parse_block(rest)
+
+
+def compression(path):
+   """
+   OVERVIEW
+
+   This function returns the compression format of the file `path` (a key of
+   `COMPRESSIONS`), or `None` for an uncompressed file.
+   """
+
+   with open(path, 'rb') as inputfile:
+      start= inputfile.read(6)
+   for name, (magic, _) in COMPRESSIONS.items():
+      if start.startswith(magic):
+         return name
+   return None
+
+
+def open_station(path):
+   """
+   OVERVIEW
+
+   This function opens the station file `path` for binary reading,
+   decompressing it on the fly if it is compressed.
+   """
+
+   name= compression(path)
+   if name is None:
+      return open(path, 'rb')
+   return COMPRESSIONS[name][1](path, 'rb')
+
+
+def read_station(path, block_size=BLOCK_SIZE):
+   """
+   OVERVIEW
+
+   This function reads the station file `path`, which may be compressed, and
+   returns a `WindSeries`.
+   """
+
+   with open_station(path) as inputfile:
+      blocks= list(iter_blocks(inputfile, block_size))
+
+   if not blocks:
+      return WindSeries([], [], [])
+
+   return WindSeries(*(np.concatenate(column) for column in zip(*blocks)))
+
+
+def read_stations(paths, workers=4, block_size=BLOCK_SIZE):
+   """
+   OVERVIEW
+
+   This generator reads the station files `paths` in a pool of `workers`
+   threads and yields `(path, series)` pairs in the order of `paths`.  At
+   most `workers` files are read ahead of the one last yielded, which bounds
+   the memory held by records waiting to be processed.
+   """
+
+   paths= list(paths)
+   with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+      pending= collections.deque()
+      for path in paths:
+         pending.append((path, pool.submit(read_station, path, block_size)))
+         if len(pending) > workers:
+            path, future= pending.popleft()
+            yield path, future.result()
+      while pending:
+         path, future= pending.popleft()
+         yield path, future.result()